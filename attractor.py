@@ -21,14 +21,19 @@ import os, sys; sys.path.append(os.path.join("..",".."))
 
 from nodebox.graphics import *
 from nodebox.graphics.geometry import distance, angle, smoothstep, clamp, Bounds
-from nodebox.graphics.physics  import Vector
 from nodebox.graphics.shader   import Shader, vec2
 from nodebox.gui               import Field, Button, Rows, Panel
 
-from math    import sin, cos, radians
+from math    import sin, cos, radians, ceil
+from hashlib import md5
+from collections import OrderedDict
 from random  import seed
-from headset import Headset
-from udp     import UDP
+from headset import Headset, ReplayHeadset
+from udp     import CoalescingUDP
+from spatial import Grid
+from world   import World, SLEEPIE, FEELIE
+from supervisor import Supervisor, IMAGES
+from timing  import Profiler
 
 try:
     ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -57,24 +62,19 @@ def _callback_save_settings(button):
          headset = Headset()
          print e
 
-settings = Panel("Headset IP", x=30, y=30, modal=False, color=(0.5,0.4,0.6,1))
-settings.append(
-    Rows(
-        controls=[
-            ("host", Field(id="host", value="128.0.0.1")),
-            ("port", Field(id="port", value="12001")),
-            Button("Connect", action=_callback_save_settings, color=(0.5,0.4,0.6,1))
-        ]
+def _settings():
+    settings = Panel("Headset IP", x=30, y=30, modal=False, color=(0.5,0.4,0.6,1))
+    settings.append(
+        Rows(
+            controls=[
+                ("host", Field(id="host", value="128.0.0.1")),
+                ("port", Field(id="port", value="12001")),
+                Button("Connect", action=_callback_save_settings, color=(0.5,0.4,0.6,1))
+            ]
+        )
     )
-)
-settings.pack()
-canvas.append(settings)
-
-#--- BIASED CHOICE -----------------------------------------------------------------------------------
-
-def choice(list, bias=None):
-    i = random(len(list), bias=bias)
-    return list[i]
+    settings.pack()
+    return settings
 
 #--- RIPPLE SHADER -----------------------------------------------------------------------------------
 
@@ -112,22 +112,206 @@ def rippled(resolution=(100,100), time=2.0, force=1000.0):
 #--- IMAGE CACHE -------------------------------------------------------------------------------------
 
 class Images(dict):
-    
+
     def __init__(self, *args, **kwargs):
+        """ A dictionary of images with blurred versions.
+            With an optional path, blurred images are stored in the given folder,
+            and loaded from it the next time (instead of blurring them again).
+            With lazy=True, a blurred version is created the first time it is requested.
+            With a budget (in bytes), the least recently used blurred versions are discarded
+            when their textures take up more memory (they are created again when requested).
+        """
+        self.path   = kwargs.pop("path", None)
+        self.lazy   = kwargs.pop("lazy", False)
+        self.budget = kwargs.pop("budget", None)
         dict.__init__(self, *args, **kwargs)
         self._blurred = {}
-    
+        self._kernel  = {}
+        self._hashes  = {} # Source file => MD5 hash of its contents.
+        self._pending = [] # (id, level)-tuples requested with Images.blurred().
+        self._lru     = OrderedDict() # (id, level) => bytes, least recently used first.
+        self.bytes    = 0
+        self.atlases  = []
+        if self.path and not os.path.exists(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                self.path = None
+
     def cache(self, id, img, kernel=3):
         self[id] = img
-        self._blurred[id] = [img]
-        for i in range(9):
-            self._blurred[id].append(blur(img, kernel=kernel, amount=i+1))
-    
+        self._blurred[id] = [img] + [None] * 9
+        self._kernel[id] = kernel
+        if not self.lazy:
+            for i in range(9):
+                self._load(id, i+1)
+
+    def _load(self, id, i):
+        # Creates blur level i of the image with the given id,
+        # and discards the least recently used levels that exceed the budget.
+        img = self._blur(self[id], kernel=self._kernel[id], amount=i)
+        self._blurred[id][i] = img
+        self._lru[(id, i)] = img.texture.width * img.texture.height * 4 # RGBA
+        self.bytes += self._lru[(id, i)]
+        while self.budget is not None and self.bytes > self.budget and len(self._lru) > 1:
+            (id, i), n = self._lru.popitem(last=False)
+            self._blurred[id][i] = None
+            self.bytes -= n
+
+    def update(self, n=1):
+        """ Creates up to n blurred versions that were requested with Images.blurred().
+            This is called once per frame, since textures can only be created in the drawing thread.
+        """
+        for id, i in self._pending[:n]:
+            if self._blurred[id][i] is None:
+                self._load(id, i)
+        self._pending = self._pending[n:]
+
+    def _blur(self, img, kernel=3, amount=1):
+        # Returns the blurred image from the cache folder, or blurs it and stores it there.
+        # If the folder is read-only (e.g., inside an application bundle), the image is blurred each time.
+        f = self._file(img, kernel, amount)
+        if f and os.path.exists(f):
+            return Image(f)
+        b = blur(img, kernel=kernel, amount=amount)
+        if f:
+            try:
+                b.save(f)
+            except (IOError, OSError):
+                pass
+        return b
+
+    def _file(self, img, kernel=3, amount=1):
+        # Returns the path of the blurred image in the cache folder,
+        # named after the MD5 hash of the source file (so that a modified file is blurred again),
+        # the kernel and the amount. Images that are not loaded from a file are not cached.
+        src = img._src[0]
+        if not self.path or not isinstance(src, basestring) or not os.path.isfile(src):
+            return None
+        if src not in self._hashes:
+            self._hashes[src] = md5(open(src, "rb").read()).hexdigest()
+        return os.path.join(self.path, "%s-k%s-a%s.png" % (self._hashes[src], kernel, amount))
+
     def blurred(self, id, t):
         """ Returns a cached blurred version of the image with the given id.
             The given t is a value between 0.0 (no blur) and 1.0 (full blur).
+            After Images.pack(), the returned image is a region in a shared atlas texture.
+            If the blurred version has not been created yet (or was discarded),
+            returns the nearest version that is available until Images.update() creates it.
+        """
+        a = self._blurred[id]
+        i = max(0, min(int(t*9), 9))
+        if a[i] is None:
+            if (id, i) not in self._pending:
+                self._pending.append((id, i))
+            i = min((abs(i-j), j) for j, img in enumerate(a) if img is not None)[1]
+        if (id, i) in self._lru:
+            self._lru[(id, i)] = self._lru.pop((id, i)) # Most recently used.
+        return a[i]
+
+    def uv(self, id, t):
+        """ Returns a (texture, coordinates)-tuple for the blurred version of the image with the given id,
+            where coordinates is a tuple of (u, v, r) for each corner (see pyglet's Texture.tex_coords).
+        """
+        t = self.blurred(id, t).texture
+        return t, t.tex_coords
+
+    def pack(self, size=250, width=2048, height=2048, padding=2):
+        """ Copies all cached (blurred) images to one or more atlas textures of the given width and height,
+            each image scaled to fit the given size, so that they can be drawn without switching textures.
+            Images.blurred() then returns images with the original width and height,
+            drawn from a region in the atlas.
+        """
+        levels = [(id, i, img) for id, a in self._blurred.items() for i, img in enumerate(a) if img is not None]
+        sizes  = []
+        for id, i, img in levels:
+            s = min(1.0, float(size) / max(img.width, img.height))
+            sizes.append((int(ceil(img.width * s)), int(ceil(img.height * s))))
+        places = _shelves(sizes, width, height, padding)
+        for page in range(max([p for p, x, y in places] or [-1]) + 1):
+            def _draw():
+                # Copy the images as they are (see shader.filter()).
+                glBlendFuncSeparate(GL_ONE, GL_ONE_MINUS_SRC_ALPHA, GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
+                for (id, i, img), (w, h), (p, x, y) in zip(levels, sizes, places):
+                    if p == page:
+                        img.draw(x, y, w, h)
+            atlas = render(_draw, width, height).texture
+            for (id, i, img), (w, h), (p, x, y) in zip(levels, sizes, places):
+                if p == page:
+                    self._blurred[id][i] = Image(atlas.get_region(x, y, w, h),
+                         width = img.width,
+                        height = img.height)
+            self.atlases.append(atlas)
+        # Textures in the atlas are not discarded.
+        for id, i, img in levels:
+            self.bytes -= self._lru.pop((id, i), 0)
+
+def _shelves(sizes, width=2048, height=2048, padding=2):
+    # Returns a list of (page, x, y)-tuples for the given list of (width, height)-tuples.
+    # Rectangles are placed left to right in rows (shelves), rows bottom to top in pages.
+    a = []
+    page, x, y, h = 0, 0, 0, 0
+    for w0, h0 in sizes:
+        if x + w0 > width:
+            x, y, h = 0, y + h + padding, 0
+        if y + h0 > height:
+            page, x, y, h = page + 1, 0, 0, 0
+        a.append((page, x, y))
+        x += w0 + padding
+        h = max(h, h0)
+    return a
+
+#--- SPRITE BATCH ------------------------------------------------------------------------------------
+# Drawing each particle with push(), translate(), rotate(), image() and pop() takes one draw call
+# (and a few matrix operations) per particle. A SpriteBatch collects the images during a frame,
+# computes the four corners of each (scaled, rotated) image on the CPU,
+# and then draws all the images that share a texture in one call.
+# Images are drawn in the order in which their texture first appeared in the batch.
+
+class SpriteBatch(dict):
+
+    def __init__(self):
+        """ A dictionary of texture id => (texture, vertices, texture coordinates, colors)-tuples.
+            Images that are regions of the same texture (see Images.pack()) are drawn together.
+        """
+        dict.__init__(self)
+        self._order = []
+
+    def append(self, img, x, y, scale=1.0, angle=0.0, color=(1,1,1,1)):
+        """ Appends the image, centered at (x, y), scaled and rotated (in degrees) around its center.
+        """
+        t = img.texture
+        if t.id not in self:
+            self[t.id] = (t, [], [], [])
+            self._order.append(t.id)
+        _, v, tc, c = self[t.id]
+        a = radians(angle)
+        w = img.width  * scale * 0.5
+        h = img.height * scale * 0.5
+        ux, uy =  w * cos(a), w * sin(a) # Half width, rotated.
+        vx, vy = -h * sin(a), h * cos(a) # Half height, rotated.
+        v.extend((
+            x - ux - vx, y - uy - vy,
+            x + ux - vx, y + uy - vy,
+            x + ux + vx, y + uy + vy,
+            x - ux + vx, y - uy + vy))
+        tc.extend(t.tex_coords)
+        c.extend(tuple(color) * 4)
+
+    def clear(self):
+        dict.clear(self)
+        self._order = []
+
+    def draw(self):
+        """ Draws all images (one call per texture) and empties the batch.
         """
-        return self._blurred[id][max(0, min(int(t*9), 9))]
+        for id in self._order:
+            t, v, tc, c = self[id]
+            glEnable(t.target)
+            glBindTexture(t.target, t.id)
+            pyglet.graphics.draw(len(v) / 2, GL_QUADS, ("v2f", v), ("t3f", tc), ("c4f", c))
+            glDisable(t.target)
+        self.clear()
 
 #--- AUDIO -------------------------------------------------------------------------------------------
 # Both loop(sample(x)) and sample(x) return an object with a play() method.
@@ -147,81 +331,31 @@ def sample(wav, streaming=False):
     return pyglet.media.load(wav, streaming=streaming)
 
 #--- PARTICLE ----------------------------------------------------------------------------------------
+# The particles and the attractor are simulated in world.py (which runs without NodeBox).
+# The subclasses below add drawing, with particles as objects (Particle) or as views on a Swarm.
 
-# Feelies only appear when valence is high:
-SLEEPIE, FEELIE = \
-    "sleepie", "feelie"
+class Drawable(object):
 
-class Particle(object):
-    
-    def __init__(self, x, y, radius=6, speed=2.0, image=None, parent=None, bounds=None, type=FEELIE):
-        """ A particle that roams around freely if it does not have a parent.
-        """
-        self.parent = parent
-        self.x      = x
-        self.y      = y
-        self.v      = Vector(1, 1, length=speed, angle=random(360))
-        self.radius = radius
-        self._steer = 0 # Left (+1), right (-1), straigh ahead (0).
-        self._speed = speed
-        self.image  = image
-        self.bounds = bounds
-        self.frames = 0 # Number of frames attached to Attractor.
-        self.color  = Color(0, 0.35, 0.65, 0.35)
-        self.alpha  = 0.0
-        self.type   = type
-
-    def _get_speed(self):
-        return self._speed
-    def _set_speed(self, v):
-        self._speed = self.v.length = v
-    speed = property(_get_speed, _set_speed)
-
-    def constrain(self):
-        """ Steer away from the (left, bottom, right, top)-bounds.
-        """
-        b = self.bounds
-        if b and (self.x < b[0] or self.y < b[1] or self.x > b[2] or self.y > b[3]):
-            m = self.speed
-            if self.x < b[0]*ZOOM: self.v.x += m
-            if self.y < b[1]*ZOOM: self.v.y += m
-            if self.x > b[2]*ZOOM: self.v.x -= m
-            if self.y > b[3]*ZOOM: self.v.y -= m
-            self.v.length = m
-
-    def update(self, steering=0.9):
-        """ Update the particle's bearing and position.
-        """
-        if random() > steering:
-            self._steer = choice((-1, 0, 1))
-        if self.parent is None:
-            # Not attached to an attractor, move in a random direction.
-            self.v.angle += self._steer
-            if self.frames < 0:
-                # Particle.framses can be lower than zero.
-                # This indicates that has just been released by the attractor.
-                self.frames += 1
-        else:
-            self.frames += 1
-        # Speed of particles shot away from the attractor.
-        # Reduce to its initialized value
-        if self.v.length > self.speed:
-            self.v.length *= 0.5
-        self.x += self.v.x
-        self.y += self.v.y
-        self.constrain()
-        # Gradually make new particles appear.
-        self.alpha += 0.01
-        self.alpha = min(self.alpha, 1.0)
-    
-    def draw(self, m=1.2, blur=False, color=[1,1,1,1], alpha=1.0):
+    __slots__ = ()
+
+    def draw(self, m=1.2, blur=False, color=[1,1,1,1], alpha=1.0, batch=None):
         """ Draw the particle with the given image, or as an ellipse (default).
+            With a SpriteBatch, the image is appended to the batch, drawn with SpriteBatch.draw().
         """
         r = self.radius * m # Increase m to let attracted particles overlap.
-        a = self.v.angle
+        a = self.heading
         if self.parent is not None:
             # Particles attached to the attractor always point to the attractor.
             a = angle(self.x, self.y, self.parent.x, self.parent.y)
+        if batch is not None and self.image is not None:
+            img = self.image
+            if blur is not False:
+                img = images.blurred(img.id, max(0.1, float(blur)))
+            batch.append(img, self.x, self.y,
+                scale = r*2 / max(self.image.width, self.image.height),
+                angle = a-90,
+                color = (color[0], color[1], color[2], self.alpha*alpha))
+            return
         push()
         translate(self.x, self.y)
         if self.image is None:
@@ -237,79 +371,41 @@ class Particle(object):
             image(img, x=-self.image.width/2, y=-self.image.height/2, color=color, alpha=self.alpha*alpha)
         pop()
 
+class Particle(Drawable, World.Particle):
+    __slots__ = ()
+
+class SwarmParticle(Drawable, World.SwarmParticle or object):
+    pass
+
+class SharedParticle(Drawable):
+
+    __slots__ = ("x", "y", "radius", "alpha", "heading", "parent", "image", "type", "frames")
+
+    def __init__(self):
+        """ A particle drawn from a Sprite, in a world that runs in another process (see SharedWorld).
+        """
+        self.parent = None # Sprite.angle already points attached particles to the attractor.
+
+    def update(self, sprite):
+        self.x, self.y, self.radius, self.alpha, self.heading = sprite[:5]
+        self.image  = images[IMAGES[int(sprite.image)]] if sprite.image >= 0 else None
+        self.type   = SLEEPIE if sprite.type else FEELIE
+        self.frames = int(sprite.frames)
+
 #--- ATTRACTOR ---------------------------------------------------------------------------------------
 
-class Attractor(Particle):
-    
+class Attractor(World.Attractor):
+
     def __init__(self, *args, **kwargs):
         """ A particle that attracts other particles and keeps them packed around itself.
         """
-        Particle.__init__(self, *args, **kwargs)
-        self.particles = []
-    
-    @property
-    def gravity(self):
-        # Used to influence the attraction radius.
-        # For example, we could increase this based on alpha wave values.
-        return 1.0 + len(self.particles) * 0.125
-    
-    def append(self, particle):
-        """ Appends the particle to the attractor.
-            It will then use circle packing forces instead of its own roaming.
-        """
-        self.particles.append(particle)
-        particle.parent = self
-        particle.v.x = 0
-        particle.v.y = 0
-        
-    def remove(self, particle):
-        # Speed is set to Attractor.radius * Attractor.gravity to shoot away.
-        particle.v.angle = angle(self.x, self.y, particle.x, particle.y)
-        particle.v.length = self.radius * self.gravity * 1.0
-        particle.parent = None
-        particle.frames = -10 # Take some time to escape attraction radius.
-        self.particles.remove(particle)
-        
-    def update(self):
-        """ Attractor roams around and sucks in particles
-        """
-        Particle.update(self)
-        
-        # Attractor wants to be in the center of the canvas.
-        # This urge increases as its gravity (i.e., number of attached particles) increases.
-        vx = self.x - canvas.width/2
-        vy = self.y - canvas.height/2
-        f = 0.0015 * self.gravity**2
-        self.x -= vx * f
-        self.y -= vy * f
-        
-        # Attractive force: move all particles to attractor.
-        for p in self.particles:
-            #p.v.angle = 0#angle(p.x, p.y, self.x, self.y) # Point to attractor.
-            f = p.radius * 0.004
-            vx = (p.x - self.x) * f
-            vy = (p.y - self.y) * f
-            p.v.x = -vx
-            p.v.y = -vy
-            
-        # Repulsive force: move away from intersecting particles.
-        for i, p1 in enumerate(self.particles):
-            for p2 in self.particles[i+1:] + [self]:
-                d = distance(p1.x, p1.y, p2.x, p2.y)
-                r = p1.radius + p2.radius
-                f = 0.15
-                if d < r - 0.01:
-                    dx = p2.x - p1.x
-                    dy = p2.y - p1.y
-                    vx = (dx / d) * (r-d) * f
-                    vy = (dy / d) * (r-d) * f
-                    if p1 != self:
-                        p1.v.x -= vx
-                        p1.v.y -= vy
-                    if p2 != self:
-                        p2.v.x += vx
-                        p2.v.y += vy
-    
+        World.Attractor.__init__(self, *args, **kwargs)
+        self._links = {} # Particle => nearest neighbor, see Attractor.links().
+        self._age = 0
+        self._buffer = None # Offscreen buffer + image + ripple filter, see Attractor.draw_halo().
+        self._halo = None
+        self._ripple = None
+
     def mesh(self, f=0.008):
         # Returns a list of (particle, dx, dy, angle)-tuples, 
         # where (dx, dy) is the tip of the particle's feeler.
@@ -330,77 +426,187 @@ class Attractor(Particle):
             ellipse(p1.x+dx1, p1.y+dy1, 1.5, 1.5)
             ellipse(p1.x, p1.y, 1, 1)
         stroke(0.8,0.9,1, 0.1)
+        links = self.links()
         for i, (p1, dx1, dy1, a1) in enumerate(points):
             # Draw connection to nearest-neighbor particle.
-            nn, d0 = None, None
-            for p2, dx2, dy2, a2 in points:
-                d = distance(p1.x, p1.y, p2.x, p2.y)
-                if p1 != p2 and (d0 is None or d < d0):
-                    nn, d0 = p2, d
+            nn = links.get(p1)
             if nn is not None:
                 line(p1.x, p1.y, nn.x, nn.y)
         nostroke()
+
+    def links(self, reuse=10):
+        """ Returns a dictionary of attached particles linked to their nearest neighbor.
+            The grid cell size is the same as in Attractor.update() (the largest sum of two radii).
+            Since the links barely change between frames, they are reused for the given number of frames,
+            unless particles are attached or removed.
+        """
+        self._age += 1
+        if self._age > reuse or len(self._links) != len(self.particles) \
+         or not all(p in self._links for p in self.particles):
+            grid = Grid(self.particles, size=2 * max([p.radius for p in self.particles] or [1]))
+            self._links = dict((p, grid.nearest(p)) for p in self.particles)
+            self._age = 0
+        return self._links
                               
+    def extent(self, points, m=1.2):
+        """ Returns the largest distance from the attractor to what draw_halo() draws:
+            each particle (with radius * m), the tip of its feeler, and the blob around the tip.
+        """
+        e = 0
+        for p, dx, dy, a in points:
+            d = distance(p.x, p.y, self.x, self.y)
+            e = max(e, d + p.radius * m)
+            d = distance(p.x + dx, p.y + dy, self.x, self.y)
+            e = max(e, d + 1)
+            if p.type == SLEEPIE:
+                e = max(e, d + BLOB.width * p.radius * 0.0125 * 0.5)
+        return e
+
     def draw_halo(self):
         points = self.mesh()
         if len(points) == 0:
             return
-        # The halo is rendered in a texture.
-        w = 400
-        h = 400
+        # The halo is rendered in a texture, as large as the attached particles + feelers + blobs.
+        # The size is rounded up to 32 pixels, so the texture is rarely reallocated.
+        # It grows at once, but only shrinks when it is more than 64 pixels too large.
+        w = h = int(ceil(self.extent(points) / 16.0) * 16) * 2
+        if self._buffer is not None and w <= self._buffer.width <= w + 64:
+            w = h = self._buffer.width
         # Translate absolute canvas position to relative texture position:
         dx = -self.x + w/2
         dy = -self.y + h/2
-        def _draw():
+        # The offscreen buffer and the ripple filter are reused between frames.
+        if self._buffer is None:
+            self._buffer = OffscreenBuffer(w, h)
+            self._ripple = rippled(force=200.0)
+        if self._halo is None or self._buffer.width != w or self._buffer.height != h:
+            self._buffer.reset(w, h)
+            self._halo = RenderedImage(self._buffer.texture)
+        # The mesh is timed as a separate stage (not as part of the halo).
+        with profiler("halo"):
+            self._buffer.push()
+            c = (GLfloat*4)(); glGetFloatv(GL_COLOR_CLEAR_VALUE, c)
+            glClearColor(0, 0, 0, 0)
+            glClear(GL_COLOR_BUFFER_BIT)
+            glClearColor(*c)
             push()
             translate(dx, dy)
+        with profiler("mesh"):
             self.draw_mesh(points)
+        with profiler("halo"):
             for p, vx, vy, a in points:
                 if p.type == SLEEPIE:
-                    push()
-                    translate(p.x+vx, p.y+vy)
-                    scale(p.radius * 0.0125)
-                    rotate(a) # Decrease alpha when far away (keeps the blobs inside the texture):
-                    image(BLOB, -BLOB.width/2, -BLOB.height/2, alpha=(p.frames-10)*0.1)
-                    pop()
-                p.draw(alpha=0.3)
+                    # Decrease alpha when far away (keeps the blobs inside the texture):
+                    blobs.append(BLOB, p.x+vx, p.y+vy,
+                        scale = p.radius * 0.0125,
+                        angle = a,
+                        color = (1, 1, 1, (p.frames-10)*0.1))
+            blobs.draw()
+            for p, vx, vy, a in points:
+                p.draw(alpha=0.3, batch=sprites)
+            sprites.draw()
             pop()
-        img = render(_draw, w, h)
-        image(img, -dx, -dy, filter=rippled(
-            resolution = ((canvas.width/2 + attractor.x), (canvas.height/2 + attractor.y)),
-                  time = canvas.frame / 30.0, 
-                 force = 200.0))
+            self._buffer.pop()
+        with profiler("ripple"):
+            self._ripple.resolution = vec2(canvas.width/2 + self.x, canvas.height/2 + self.y)
+            self._ripple.time = canvas.frame / 30.0
+            self._halo.draw(-dx, -dy, filter=self._ripple)
 
     def draw(self):
         #Particle.draw(self)
         r = min(210, self.radius * self.gravity)
         ellipse(self.x, self.y, r*2, r*2, fill=None, stroke=[1,1,1,0.1], strokewidth=0.25) # gravity
 
+#--- WORLD -------------------------------------------------------------------------------------------
+
+class Valence(World):
+    # The world, with particles that can be drawn.
+    Particle      = Particle
+    SwarmParticle = SwarmParticle
+    Attractor     = Attractor
+
+class SharedWorld(object):
+
+    def __init__(self, supervisor, i=0):
+        """ World i of the given Supervisor, which runs in another process (see supervisor.py).
+            It has the same interface as Valence in draw(): SharedWorld.advance() passes attract and spawn
+            to the process, and reads the last state it shared (the process steps at its own rate).
+        """
+        self.supervisor = supervisor
+        self.i          = i
+        self.width      = 1000
+        self.height     = 600
+        self.particles  = []
+        self.attractor  = Attractor(500, 250, radius=40, speed=1.0)
+        self.zoom       = 1.25
+        self.frame      = 0
+        self.events     = []
+        self._events    = (0, 0) # Number of attracted and repulsed particles so far.
+
+    def advance(self, dt, attract=False, spawn=False):
+        self.supervisor.control(self.i, attract=attract, spawn=spawn)
+        s, a = self.supervisor.state(self.i)
+        self.frame = int(s.frame)
+        self.zoom  = s.zoom
+        self.attractor.x = s.x
+        self.attractor.y = s.y
+        self.attractor.radius = s.radius
+        # Particles are reused by index (so that Attractor.links() can reuse the links between frames).
+        while len(self.particles) < len(a):
+            self.particles.append(SharedParticle())
+        del self.particles[len(a):]
+        for p, sprite in zip(self.particles, a):
+            p.update(sprite)
+        self.attractor.particles = [p for p, sprite in zip(self.particles, a) if sprite.attached]
+        n1, n2 = int(s.attracted), int(s.repulsed)
+        self.events  = [("attract", None)] * (n1 - self._events[0])
+        self.events += [("repulse", None)] * (n2 - self._events[1])
+        self._events = (n1, n2)
+        return 1.0
+
+    def interpolate(self, t):
+        pass
+
 def setup(canvas):
     global headset
     global dimmer
     global images
     global samples
+    global world
     global particles
     global attractor
-    global ZOOM, ATTRACT, SPAWN, DIM, delay; delay=0
+    global ATTRACT, SPAWN, DIM, delay; delay=0
     global BLOB; BLOB=Image(abspath("g","blob.png")) # See Attractor.draw_halo().
+    global sprites, blobs
     global MUTE
+    global profiler
+    global supervisor
 
     # ----------------------------------------------------
     #headset = Headset(host="169.254.132.243", port=12002)
-    headset = Headset()
+    # python attractor.py session.bin replays a session recorded with Headset.record().
+    # python attractor.py --profile saves the frame timings to profile.csv on exit.
+    # python attractor.py --supervised runs the world in another process (see supervisor.py).
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if len(args) > 0 and os.path.isfile(args[0]):
+        headset = ReplayHeadset(args[0], loop=True)
+    else:
+        headset = Headset(threaded=True)
     # ----------------------------------------------------
     #dimmer = None
-    dimmer = UDP("10.0.1.2", 7000)
+    dimmer = CoalescingUDP("10.0.1.2", 7000, threshold=1.0, interval=1.0)
     # ----------------------------------------------------
     
-    # Blurred images:
-    images = Images()
+    # Blurred images (stored in g/cache/ after the first launch):
+    images = Images(path=abspath("g","cache"))
+    #images = Images(path=abspath("g","cache"), lazy=True, budget=32*1024*1024) # No atlas.
     for f in files(os.path.join("g","cell","*.png")):
         img = Image(abspath(f))
         images.cache(img.id, img, kernel=15)
         images[os.path.basename(f)] = images[img.id]
+    # Blur levels are drawn from a few atlas textures (particles are at most ~200px on screen):
+    if not images.lazy:
+        images.pack(size=250)
         
     # Audio samples:
     samples = {}
@@ -409,23 +615,27 @@ def setup(canvas):
     samples["ambient_lo"] = loop(sample(abspath("audio","ambient_lo.wav")))
     samples["ambient_hi"] = loop(sample(abspath("audio","ambient_hi.wav")))
     
-    # Particles:
-    particles = []
-    for i in range(40):
-        particles.append(
-            Particle(x = random(canvas.width), 
-                     y = random(canvas.height), 
-                 image = images["flower1.png"],
-                radius = 15 + random(20),
-                bounds = (-65, -65, canvas.width+65, canvas.height+65),
-                  type = SLEEPIE))
-    
-    # Attractor:
-    attractor = Attractor(500, 250, radius=40, speed=1.0)
-    attractor.bounds = (150, 100, canvas.width-100, canvas.height-100)
-
-    # Canvas zoom (relative to attractor size):
-    ZOOM = 1.25
+    # Particle images are drawn in batches, one draw call per texture:
+    sprites = SpriteBatch()
+    blobs = SpriteBatch()
+
+    # Particles + attractor (see world.py).
+    # With engine="swarm", the particles are updated all at once with numpy (e.g., for thousands).
+    # With --supervised, the world runs in another process, with the input of this headset.
+    supervisor = None
+    if "--supervised" in sys.argv:
+        supervisor = Supervisor(worlds=1, particles=40, width=canvas.width, height=canvas.height)
+        supervisor.start()
+        world = SharedWorld(supervisor)
+    else:
+        world = Valence(canvas.width, canvas.height, images=images, engine="python")
+        world.populate(40)
+    particles = world.particles
+    attractor = world.attractor
+
+    # Time spent in each stage of draw() (hold ALT to display, saved to profile.csv with --profile).
+    profiler = Profiler(n=600)
+    world.profiler = profiler
     
     # Spacebar toggles between ignore/receive input.
     MUTE = False
@@ -433,17 +643,15 @@ def setup(canvas):
     # Value that drops to zero when relaxed.
     DIM = 1.0
 
-# Load stuff before opening window.
-setup(canvas)
-
 def draw(canvas):
     global headset
     global dimmer
     global images
     global samples
+    global world
     global particles
     global attractor
-    global ZOOM, ATTRACT, SPAWN, DIM, delay
+    global ATTRACT, SPAWN, DIM, delay
     global MUTE
     
     glEnable(GL_DITHER)
@@ -455,10 +663,15 @@ def draw(canvas):
     if canvas.key.code == SPACE:
         MUTE = not MUTE
 
+    # Create requested blur levels (see Images.blurred()).
+    with profiler("images"):
+        images.update()
+
     # Poll the headset.
     # Is alpha above average? => attraction.
     # Is valence above average? => spawn feelies.
-    headset.update(buffer=1024)
+    with profiler("headset"):
+        headset.update(buffer=1024, drain=True)
     ATTRACT = False
     ATTRACT = delay > 0
     ATTRACT = ATTRACT or SHIFT in canvas.key.modifiers
@@ -483,13 +696,15 @@ def draw(canvas):
     
     # Dimmer sends a value over UDP that drops to 0 when relaxed.
     # It can be used to dim ambient lighting using a domotica module.
+    # Only changes of at least 1% are sent (and the current value each second).
     m = 0.0025
     if ATTRACT:
         DIM = clamp(DIM-m, 0.0, 1.0)
     else:
         DIM = clamp(DIM+m, 0.0, 1.0)
     if DIM < 0.8 and dimmer is not None:
-        dimmer.send("%.2f" % (DIM * 100))
+        with profiler("dimmer"):
+            dimmer.send(DIM * 100)
     
     # Valence controls the balance between high and low ambient.
     v = headset.valence.slope # -1.0 => +1.0
@@ -499,11 +714,14 @@ def draw(canvas):
     # Mouse changes the volume of low and high ambient sound.
     #dx = canvas.mouse.relative_x
     #dy = canvas.mouse.relative_y
-    samples["ambient_lo"].play(volume=0.7 * dx)
-    samples["ambient_hi"].play(volume=0.7 * dy)
+    with profiler("audio"):
+        samples["ambient_lo"].play(volume=0.7 * dx)
+        samples["ambient_hi"].play(volume=0.7 * dy)
 
     if canvas.key.code == ALT:
         text("%.2f FPS" % canvas.profiler.framerate, canvas.width-80, 15, align=RIGHT, fill=[1,1,1,0.75])
+        for i, s in enumerate(profiler.lines()):
+            text(s, canvas.width-280, canvas.height-25-i*12, font="Courier", fontsize=9, fill=[1,1,1,0.75])
 
     if canvas.frame / 20 % 2 == 0:
         fill(1,1,1, 0.75)
@@ -521,81 +739,64 @@ def draw(canvas):
         elif MUTE:
             text(" READY", 20, 15)
 
+    # Simulate the time since the last frame, in fixed steps (see World.advance()),
+    # and draw the particles in between the last two steps.
+    # The attractor wants to be in the center of the canvas (which can be resized).
+    # The world times its "particles" and "attractor" stages with the same profiler.
+    # A SharedWorld (--supervised) is stepped in another process, and only reads its last state here.
+    world.width, world.height = canvas.width, canvas.height
+    t = world.advance(canvas.elapsed, attract=ATTRACT, spawn=SPAWN)
+    with profiler("interpolate"):
+        world.interpolate(t)
+    for event, p in world.events:
+        if event == "attract":
+            samples["attract"].play().volume = 0.75
+        if event == "repulse":
+            samples["repulse"].play()
+
     # Zoom out as the attractor grows larger.
-    # Integrate the zoom scale to make the transition smoother.
-    d = (1.25 - len(attractor.particles) * 0.05)
-    if ZOOM > -0.15 and ZOOM > d:
-        ZOOM -= 0.0025
-    if ZOOM < +1.25 and ZOOM < d:
-        ZOOM += 0.0025   
-    dx = 0.5 * ZOOM * canvas.width
-    dy = 0.5 * ZOOM * canvas.height
+    dx = 0.5 * world.zoom * canvas.width
+    dy = 0.5 * world.zoom * canvas.height
     translate(-dx, -dy)
-    scale(1.0 + ZOOM)
-
-    for p in list(particles):
-        d = distance(p.x, p.y, attractor.x, attractor.y)
-        t = d / canvas.width * 2
-        p.update()
-        # When valence is low, unattached feelie particles fade away.
-        if SPAWN is False:
-            if p.parent is None and p.type == FEELIE:
-                p.alpha -= 0.04
-                p.alpha = max(p.alpha, 0)
-                if p.alpha == 0:
-                    # Remove hidden feelies, so we have a chance to see new ones.
-                    particles.remove(p)
-        # Check if a particle falls within the attraction radius:
-        # If so, attract it when alpha is above average.
-        if ATTRACT is True:
-            if p.parent is None and p.frames >= 0 and p.alpha >= 0.25:
-                if d < min(210, p.radius + attractor.radius * attractor.gravity):
-                    attractor.append(p)
-                    samples["attract"].play().volume = 0.75
-        p.draw(blur=t, alpha=(1-t))
-                    
-    # Repulse when alpha drops below average.
-    # Press mouse to repulse attracted particles.
-    if ATTRACT is False:
-        if random() > 0.5:
-            if len(attractor.particles) > 0:
-                attractor.remove(attractor.particles[0])
-                samples["repulse"].play()
-                
-    # When valence is high, feelie particles appear.
-    if SPAWN is True: 
-        if random() > 0.5:
-            if len(particles) < 80:
-                p = Particle(x = choice((-30, canvas.width+30)),
-                             y = -30,
-                         image = choice([images["flower%i.png"%i] for i in range(2,6+1)], bias=0.25),
-                        radius = 15 + random(20),
-                        bounds = (-65, -65, canvas.width+65, canvas.height+65),
-                         speed = 3.5,
-                          type = FEELIE)
-                if p.image._src[0].endswith("flower3.png"):
-                    p.radius = 20 + random(20)
-                if p.image._src[0].endswith("flower4.png"):
-                    p.radius = 15 + random(10)
-                if p.image._src[0].endswith("flower5.png"):
-                    p.radius = 15
-                if p.image._src[0].endswith("flower6.png"):
-                    p.radius = 10 + random(5)
-                particles.append(p)
-
-    attractor.update()
+    scale(1.0 + world.zoom)
+
+    with profiler("sprites"):
+        for p in particles:
+            t = distance(p.x, p.y, attractor.x, attractor.y) / canvas.width * 2
+            p.draw(blur=t, alpha=(1-t), batch=sprites)
+        sprites.draw()
+
     attractor.draw_halo()
     attractor.draw()
 
+    profiler.frame()
+
     #canvas.save("attractor"+str(canvas.frame)+".png")
 
 def stop(canvas):
     headset.close()
-
-canvas.name = "Valence"
-canvas.size = 1000, 600
-#canvas.fullscreen = True
-#canvas.mouse.cursor = HIDDEN
-canvas.draw = draw
-canvas.stop = stop
-canvas.run()
\ No newline at end of file
+    if supervisor is not None:
+        supervisor.stop()
+    if dimmer is not None:
+        dimmer.close()
+    if "--profile" in sys.argv:
+        try:
+            profiler.save(abspath("profile.csv"))
+        except IOError:
+            pass
+
+if __name__ == "__main__":
+
+    # With --supervised on Windows, multiprocessing imports this script again in the world process
+    # (see supervisor.py), which must not set up the headset and open a second window.
+    # The canvas size is set first, since setup() passes it to the world.
+    canvas.name = "Valence"
+    canvas.size = 1000, 600
+    #canvas.fullscreen = True
+    #canvas.mouse.cursor = HIDDEN
+    canvas.append(_settings())
+    # Load stuff before opening window.
+    setup(canvas)
+    canvas.draw = draw
+    canvas.stop = stop
+    canvas.run()
@@ -0,0 +1,180 @@
+#### VALENCE BENCHMARKS ##############################################################################
+
+# Authors: Valence contributors
+# License: GNU General Public License v3, see LICENSE.txt
+# Copyright (c) 2026 Valence contributors
+# All rights reserved.
+
+# Usage: python bench.py
+# Reports the time per call for the hot paths that do not need a window (or a headset),
+# including the headless simulation in world.py (calls/s = frames per second of pure physics).
+
+import os
+import struct
+import tempfile
+import time
+
+from headset import decode, Headset, BandPower, Recorder, ReplayHeadset, RAW, ALPHA, VALENCE
+from world   import World, Swarm
+
+######################################################################################################
+
+def packet(samples=25, channels=8):
+    """ Returns a datagram as streamed by the headset application:
+        RAW readings for each channel, alpha for each channel, and valence.
+        With samples=25, this is 8 * 104 + 8 * 12 + 12 = 940 bytes (+ 8 bytes "#bundle:").
+    """
+    s = "#bundle:"
+    for i in range(channels):
+        s += struct.pack("<BBH", RAW, i, samples)
+        s += struct.pack("<%si" % samples, *[(j * 7919 % 2000 - 1000) * 100 for j in range(samples)])
+    for i in range(channels):
+        s += struct.pack("<BBHii", ALPHA, i, 1, 150000, 120000)
+    s += struct.pack("<BBHii", VALENCE, 0, 1, -50000, 10000)
+    return s
+
+def bench(name, function, n=1000):
+    """ Calls the given function n times and prints the average time per call.
+    """
+    t = time.time()
+    for i in range(n):
+        function()
+    t = (time.time() - t) / n
+    print "%-40s %10.1f us/call %10.0f calls/s" % (name, t * 1e6, 1.0 / (t or 1e-9))
+    return t
+
+#--- DECODER -----------------------------------------------------------------------------------------
+
+def bench_decode(n=1000):
+    data = packet()
+    t1 = bench("decode (per-sample)", lambda: decode(data, vectorized=False), n)
+    t2 = bench("decode (vectorized)", lambda: decode(data), n)
+    print "%-40s %10.1fx" % ("speedup", t1 / (t2 or 1e-9))
+    print "%-40s %10.1f MB/s %7.0f samples/s" % ("decode throughput", 
+        len(data) / (t2 or 1e-9) / 1e6, 8 * 25 / (t2 or 1e-9))
+
+#--- CHANNELS ----------------------------------------------------------------------------------------
+
+def bench_channels(n=1000):
+    data = packet()
+    for ring in (False, True):
+        h = Headset(port=None, ring=ring)
+        def update():
+            h._feed(data)
+            h._trim()
+        bench("update (ring=%s)" % ring, update, n)
+    h = Headset(port=None, bandpower=BandPower())
+    def update():
+        h._feed(data)
+        h._trim()
+    bench("update (bandpower)", update, n)
+
+#--- REPLAY ------------------------------------------------------------------------------------------
+
+def bench_replay(n=1000):
+    # Records n datagrams and replays them as fast as possible (decoder throughput).
+    path = tempfile.mktemp(suffix=".bin")
+    r = Recorder(path)
+    data = packet()
+    for i in range(n):
+        r.write(data)
+    r.close()
+    h = ReplayHeadset(path, realtime=False)
+    t = time.time()
+    h.update(drain=True)
+    t = time.time() - t
+    h.close()
+    os.remove(path)
+    print "%-40s %10.0f datagrams/s %7.0f samples/s" % ("replay", n / t, n * 8 * 25 / t)
+
+#--- SWARM -------------------------------------------------------------------------------------------
+
+def bench_swarm(n=100):
+    try:
+        from swarm import Swarm
+    except ImportError:
+        print "%-40s %s" % ("swarm", "requires numpy")
+        return
+    from random import random
+    for m in (40, 200, 1000, 10000):
+        s = Swarm(capacity=m, seed=0)
+        for i in range(m):
+            s.append(random() * 1000, random() * 600, radius=15 + random() * 20, bounds=(-65, -65, 1065, 665))
+        bench("swarm.update (%s particles)" % m, s.update, n)
+
+#--- CIRCLE PACKING ----------------------------------------------------------------------------------
+
+class Point(object):
+    
+    def __init__(self, x, y, radius=0.0):
+        self.x, self.y, self.radius, self.vx, self.vy = x, y, radius, 0.0, 0.0
+
+def cluster(n, seed=0):
+    """ Returns a (particles, attractor)-tuple, with n particles packed around the attractor
+        in a repeatable (seeded) random layout, with velocity (vx, vy).
+    """
+    from random import Random
+    r = Random(seed)
+    a = Point(500, 300, 40)
+    p = []
+    for i in range(n):
+        d = r.random() * (40 + 30 * n ** 0.5)
+        p.append(Point(a.x + d * r.uniform(-1, 1), a.y + d * r.uniform(-1, 1), 15 + r.random() * 20))
+    return p, a
+
+def check_pack(seed=0):
+    # Compares the vectorized packing forces (numpy) to the pair-by-pair forces (Python).
+    import packing
+    if packing.numpy is None:
+        return
+    for n in (10, 100, 1000):
+        p, a = cluster(n, seed)
+        packing.pack(p, a, vectorized=False)
+        v1 = [(q.vx, q.vy) for q in p]
+        packing.pack(p, a)
+        v2 = [(q.vx, q.vy) for q in p]
+        e = max(max(abs(x1 - x2), abs(y1 - y2)) for (x1, y1), (x2, y2) in zip(v1, v2))
+        print "%-40s %10.2e max error" % ("pack (%s particles)" % n, e)
+
+def bench_pack(n=100):
+    import packing
+    for m in (40, 200, 1000):
+        p, a = cluster(m)
+        bench("pack (python, %s particles)" % m, lambda: packing.pack(p, a, vectorized=False), n)
+        if packing.numpy is not None:
+            bench("pack (numpy, %s particles)" % m, lambda: packing.pack(p, a), n)
+
+#--- WORLD -------------------------------------------------------------------------------------------
+
+def bench_world(n=2000):
+    # Frames per second of the simulation (attracting and spawning now and then, as in world.py).
+    for engine in ("python", "swarm"):
+        if engine == "swarm" and Swarm is None:
+            print "%-40s %s" % ("world.step (swarm)", "requires numpy")
+            continue
+        for m in (40, 200, 1000, 10000):
+            w = World(seed=0, engine=engine)
+            w.populate(m)
+            def step():
+                w.step(attract=w.frame // 30 % 2 == 1, spawn=w.frame // 20 % 3 == 0)
+            bench("world.step (%s, %s particles)" % (engine, m), step, max(5, n // m))
+
+def bench_attractor(n=100):
+    # Time per Attractor.update() as the number of attached particles grows.
+    for m in (10, 40, 100, 250, 1000):
+        w = World(seed=0)
+        w.populate(m)
+        for p in list(w.particles):
+            w.attractor.append(p)
+        a = w.attractor
+        bench("attractor.update (%s attached)" % m, lambda: a.update(w.width/2, w.height/2, w.zoom), n)
+
+if __name__ == "__main__":
+    bench_decode()
+    bench_channels()
+    bench_replay()
+    bench_swarm()
+    check_pack()
+    bench_pack()
+    bench_world()
+    bench_attractor()
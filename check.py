@@ -0,0 +1,76 @@
+#### VALENCE: REGRESSION CHECK ######################################################################
+
+# Authors: Valence contributors
+# License: GNU General Public License v3, see LICENSE.txt
+# Copyright (c) 2026 Valence contributors
+# All rights reserved.
+
+# Compares the output of the decoder and the physics to known values, for continuous integration.
+# Usage: python check.py
+# Exits with status 1 if a value is different. If a change to the physics is intended,
+# run the check and copy the new values it prints into EXPECTED.
+
+import sys
+
+from hashlib import md5
+
+import packing
+
+from headset import decode
+from bench   import packet
+from world   import World, Swarm
+
+######################################################################################################
+
+# The checksums depend on floating-point rounding, so they are for Python 2.7 (and numpy 1.16).
+# The packing forces computed with numpy and one pair at a time differ only in the last bits,
+# so that both yield the same checksum (as long as they do, the two are interchangeable).
+EXPECTED = {
+    "decode"                    : "60eb19b4b51f9bdbc6df3dbb6e973637",
+    "world (python, numpy)"     : "d7d0afb5ed2858d18fd70a945cd84a21",
+    "world (python, no numpy)"  : "d7d0afb5ed2858d18fd70a945cd84a21",
+    "world (swarm)"             : "95097bcb0b10938e8c6f18c30cef46b4",
+}
+
+def _decode():
+    # The decoded datagram from bench.packet(), one block at a time and in one call.
+    data = packet()
+    a = decode(data)
+    if a != decode(data, vectorized=False):
+        return "vectorized != per-sample"
+    return md5(repr(a)).hexdigest()
+
+def _world(engine="python", vectorized=True, frames=600, n=40, seed=0):
+    # The checksum of the simulation with n particles, spawning for 300 frames,
+    # and attracting after 100 frames (so that about half of the particles are packed).
+    v = packing.numpy
+    if not vectorized:
+        packing.numpy = None
+    try:
+        w = World(seed=seed, engine=engine)
+        w.populate(n)
+        for i in range(frames):
+            w.step(attract=i >= 100, spawn=i < 300)
+        return w.checksum()
+    finally:
+        packing.numpy = v
+
+def check():
+    """ Returns a list of (name, expected, actual)-tuples for each value that is different.
+    """
+    actual = {}
+    actual["decode"] = _decode()
+    actual["world (python, no numpy)"] = _world(vectorized=False)
+    if packing.numpy is not None:
+        actual["world (python, numpy)"] = _world()
+    if Swarm is not None:
+        actual["world (swarm)"] = _world(engine="swarm")
+    return [(k, EXPECTED[k], v) for k, v in sorted(actual.items()) if EXPECTED[k] != v]
+
+if __name__ == "__main__":
+    errors = check()
+    for k, v1, v2 in errors:
+        print "%-30s expected %s, got %s" % (k, v1, v2)
+    if errors:
+        sys.exit(1)
+    print "ok"
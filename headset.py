@@ -13,8 +13,22 @@ __license__   = "GPL"
 
 import socket
 import struct
+import os
+import time
+import math
+import mmap
+import threading
+import operator
 import collections
 
+from array     import array
+from itertools import islice
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 ######################################################################################################
 
 #-----------------------------------------------------------------------------------------------------
@@ -24,40 +38,226 @@ RAW, ALPHA, VALENCE = 1, 2, 3
 class BufferError(Exception):
     pass
 
-class Channel(collections.deque):
+#--- DECODER -----------------------------------------------------------------------------------------
+# Each datagram is a sequence of blocks, optionally prefixed with "#bundle:".
+# Each block starts with 4 bytes of metadata:
+# 1 byte is the type (RAW, ALPHA, VALENCE).
+# 1 byte is the channel (0-7), corresponding to an electrode on the headset,
+# 2 bytes is the length (number of readings for this channel).
+# RAW readings are 4 bytes each (signed int), which must be divided by 100,000.
+# ALPHA and VALENCE have 4 bytes for the value + 4 bytes for the LTA (long-term average).
 
-    def __init__(self, iterable=[]):
-        """ A list of measurements from an electrode on the headset.
-            For alpha and valence channels, the list contains (value, long-term average) tuples.
+BUNDLE = "#bundle:"
+HEADER = struct.Struct("<BBH")
+SAMPLE = struct.Struct("<i")
+PAIR   = struct.Struct("<ii")
+SCALE  = 100000.0
+
+def _raw(data, i, length):
+    # Decodes the given number of RAW readings starting at offset i, in one call.
+    return [r / SCALE for r in struct.unpack_from("<%si" % length, data, i)]
+
+def _raw_slow(data, i, length):
+    # Decodes the given number of RAW readings starting at offset i, one by one.
+    a = []
+    for j in range(length):
+        r = SAMPLE.unpack_from(data, i+4*j)[0]
+        r = float(r) / 100000
+        a.append(r)
+    return a
+
+def decode(data, n=None, vectorized=True):
+    """ Returns a list of (type, channel, values)-tuples for the given datagram (str or bytearray),
+        of which only the first n bytes are read (by default, all of them).
+        For RAW, values is a list of floats. For ALPHA and VALENCE, it is a (value, LTA)-tuple.
+        The datagram is walked once using offsets, blocks are not copied.
+    """
+    n = len(data) if n is None else n
+    i = data.startswith(BUNDLE) and len(BUNDLE) or 0
+    f = vectorized and _raw or _raw_slow
+    a = []
+    while i + 4 <= n:
+        type, channel, length = HEADER.unpack_from(data, i)
+        i += 4
+        if type == RAW:
+            # A truncated block yields the readings that are complete.
+            length = min(length, (n - i) // 4)
+            a.append((type, channel, f(data, i, length)))
+            i += 4 * length
+        elif type in (ALPHA, VALENCE) and i + 8 <= n:
+            v1, v2 = PAIR.unpack_from(data, i)
+            a.append((type, channel, (float(v1) / 100000, float(v2) / 100000)))
+            i += 8
+        else:
+            # Unknown or truncated block, ignore the rest.
+            break
+    return a
+
+#--- ROLLING STATISTICS ------------------------------------------------------------------------------
+# Channel.min, max and avg are all-time statistics, which become meaningless after a while.
+# Channel.rolling has the mean, variance, min and max of the measurements that are kept (history),
+# updated incrementally as blocks of measurements are appended and removed:
+# Welford's algorithm for mean and variance (Chan's variant, to merge and remove whole blocks),
+# monotonic queues for min and max (amortized O(1) per measurement).
+# For a block, only the values lower (higher) than all values after them are queued.
+# Rolling statistics are optional (Channel(rolling=True)), since they cost a Python loop per block.
+# Headset enables them for alpha and valence (one value per datagram), not for the raw channels.
+
+def _moments(values):
+    # Returns the (count, mean, sum of squared differences from the mean) of the given values.
+    n = len(values)
+    s = float(sum(values))
+    return n, s / n, max(0.0, sum(map(operator.mul, values, values)) - s * s / n)
+
+def _extrema(values, cmp=operator.lt):
+    # Returns the (index, value)-tuples in the given list that are lower (cmp=lt) or higher (cmp=gt)
+    # than all values after them, i.e., the only candidates for the min (or max) in a sliding window.
+    a = []
+    m = None
+    for i in xrange(len(values)-1, -1, -1):
+        v = values[i]
+        if m is None or cmp(v, m):
+            a.append((i, v))
+            m = v
+    a.reverse()
+    return a
+
+class Rolling(object):
+
+    def __init__(self):
+        """ Statistics over a sliding window of measurements.
         """
-        collections.deque.__init__(self, iterable)
+        self.n     = 0   # Number of measurements in the window.
+        self.mean  = 0.0
+        self._m2   = 0.0 # Sum of squared differences from the mean.
+        self._i    = 0   # Number of measurements appended.
+        self._j    = 0   # Number of measurements removed.
+        self._low  = collections.deque() # (index, value)-tuples, values increasing.
+        self._high = collections.deque() # (index, value)-tuples, values decreasing.
+
+    def push(self, v):
+        """ Appends the given measurement to the window.
+        """
+        self.extend((v,))
+
+    def pop(self, v):
+        """ Removes the given oldest measurement from the window.
+        """
+        self.remove((v,))
+
+    def extend(self, values):
+        """ Appends the given list of measurements to the window.
+        """
+        if len(values) == 1:
+            self._append(values[0])
+        elif len(values) > 1:
+            self._merge(list(values))
+
+    def _append(self, v):
+        # Welford's algorithm.
+        self.n += 1
+        d = v - self.mean
+        self.mean += d / self.n
+        self._m2 += d * (v - self.mean)
+        q = self._low
+        while q and q[-1][1] >= v:
+            q.pop()
+        q.append((self._i, v))
+        q = self._high
+        while q and q[-1][1] <= v:
+            q.pop()
+        q.append((self._i, v))
+        self._i += 1
+
+    def _merge(self, values):
+        # Chan's algorithm, merges the statistics of the given values.
+        n1, m1, s1 = self.n, self.mean, self._m2
+        n2, m2, s2 = _moments(values)
+        n = n1 + n2
+        d = m2 - m1
+        self.n    = n
+        self.mean = m1 + d * n2 / n
+        self._m2  = s1 + s2 + d * d * n1 * n2 / n
+        for q, cmp in ((self._low, operator.lt), (self._high, operator.gt)):
+            a = _extrema(values, cmp)
+            while q and not cmp(q[-1][1], a[0][1]):
+                q.pop()
+            q.extend((self._i + i, v) for i, v in a)
+        self._i += n2
+
+    def remove(self, values):
+        """ Removes the given list of oldest measurements from the window.
+        """
+        n2 = len(values)
+        if n2 == 0:
+            return
+        n1 = self.n - n2
+        if n1 <= 0:
+            self.n    = 0
+            self.mean = 0.0
+            self._m2  = 0.0
+        elif n2 == 1:
+            v = values[0]
+            d = v - self.mean
+            self.n     = n1
+            self.mean -= d / n1
+            self._m2   = max(0.0, self._m2 - d * (v - self.mean))
+        else:
+            n, m, s = self.n, self.mean, self._m2
+            n2, m2, s2 = _moments(list(values))
+            m1 = (n * m - n2 * m2) / n1
+            d  = m2 - m1
+            self.n    = n1
+            self.mean = m1
+            self._m2  = max(0.0, s - s2 - d * d * n1 * n2 / n)
+        self._j += n2
+        j = self._j
+        q = self._low
+        while q and q[0][0] < j:
+            q.popleft()
+        q = self._high
+        while q and q[0][0] < j:
+            q.popleft()
+
+    @property
+    def variance(self):
+        return self._m2 / (self.n or 1)
+
+    @property
+    def stdev(self):
+        return self.variance ** 0.5
+
+    @property
+    def min(self):
+        return self._low[0][1] if self._low else None
+
+    @property
+    def max(self):
+        return self._high[0][1] if self._high else None
+
+#--- CHANNEL -----------------------------------------------------------------------------------------
+
+class _Statistics(object):
+    # Statistics shared by Channel and RingChannel, which call _count() for new measurements
+    # and implement _value(i) to return the measurement at index i (without the LTA).
+
+    def _reset(self, rolling=False):
+        self.rolling = Rolling() if rolling else None
         self._total  = 0     # Sum of all measurements.
         self._length = 0     # Amount of measurements.
         self._min    = +2000 # All-time lowest measurement.
         self._max    = -2000 # All-time highest measurement.
-    
-    def push(self, v):
-        collections.deque.append(self, v)
-        if isinstance(v, tuple):
-            v = v[0]
-        self._total += v
-        self._length += 1
-        # Progressively update min and max.
-        self._min = min(self._min, v)
-        self._max = min(self._max, v)
-        
-    def pop(self):
-        collections.deque.popleft(self)
-    
-    @property
-    def current(self):
-        """ Returns the most recent value, or None.
-        """
-        try:
-            return self[-1][0]
-        except:
-            return None
-    
+
+    def _count(self, values):
+        if self.rolling is not None:
+            self.rolling.extend(values)
+        if len(values) > 0:
+            self._total += sum(values)
+            self._length += len(values)
+            # Progressively update min and max.
+            self._min = min(self._min, min(values))
+            self._max = max(self._max, max(values))
+
     @property
     def min(self):
         """ Yields the lowest of all measurements.
@@ -76,23 +276,14 @@ class Channel(collections.deque):
         """
         return self._total / (self._length or 1)
         
-    @property
-    def lta(self):
-        """ Yields the long-term average (for alpha and valence).
-        """
-        try:
-            return self[-1][1]
-        except:
-            return None
-        
     @property
     def slope(self, d=50):
         """ Yields a value between -1.0 and 1.0 indicating if the curve rises or drops.
         """
         d = min(d, len(self))
         if d > 0:
-            x = self.relative(self[-d][0])
-            y = self.relative(self[-1][0])
+            x = self.relative(self._value(-d))
+            y = self.relative(self._value(-1))
             return (x-y) / -1
         else:
             return 0.0
@@ -106,11 +297,346 @@ class Channel(collections.deque):
         """
         return ((v or 0) - self.min) / (self.max or 1)
 
+class Channel(collections.deque, _Statistics):
+
+    def __init__(self, iterable=[], rolling=False):
+        """ A list of measurements from an electrode on the headset.
+            For alpha and valence channels, the list contains (value, long-term average) tuples.
+            With rolling=True, Channel.rolling has statistics over the measurements in the list.
+        """
+        collections.deque.__init__(self, iterable)
+        self._reset(rolling)
+    
+    def push(self, v):
+        collections.deque.append(self, v)
+        if isinstance(v, tuple):
+            v = v[0]
+        self._count((v,))
+    
+    def extend(self, values):
+        """ Appends the given list of measurements (floats), faster than push() for each.
+        """
+        collections.deque.extend(self, values)
+        self._count(values)
+        
+    def pop(self):
+        v = collections.deque.popleft(self)
+        if self.rolling is not None:
+            self.rolling.pop(v[0] if isinstance(v, tuple) else v)
+        return v
+
+    def trim(self, n):
+        """ Removes the oldest measurements so that at most n are left.
+        """
+        if self.rolling is None:
+            for i in xrange(len(self) - n):
+                collections.deque.popleft(self)
+            return
+        a = [collections.deque.popleft(self) for i in xrange(len(self) - n)]
+        if a and isinstance(a[0], tuple):
+            a = [v[0] for v in a]
+        self.rolling.remove(a)
+
+    def window(self, n=None, lta=False):
+        """ Returns a tuple with the most recent n values (by default, all), oldest-first.
+            For alpha and valence, with lta=True it contains the long-term averages instead.
+        """
+        n = len(self) if n is None else min(n, len(self))
+        a = islice(self, len(self) - n, None)
+        if len(self) > 0 and isinstance(self[-1], tuple):
+            return tuple(v[int(bool(lta))] for v in a)
+        return tuple(a)
+
+    def _value(self, i):
+        v = self[i]
+        if isinstance(v, tuple):
+            v = v[0]
+        return v
+    
+    @property
+    def current(self):
+        """ Returns the most recent value, or None.
+        """
+        try:
+            return self[-1][0]
+        except:
+            return None
+        
+    @property
+    def lta(self):
+        """ Yields the long-term average (for alpha and valence).
+        """
+        try:
+            return self[-1][1]
+        except:
+            return None
+
+#--- RING CHANNEL ------------------------------------------------------------------------------------
+# A Channel stores each measurement as a Python float (24 bytes) or tuple (56 + 2x24 bytes),
+# and Headset.update() pops the oldest measurements one by one.
+# A RingChannel stores measurements in a preallocated array of floats,
+# in which appending a block of measurements is a single slice assignment.
+# Each measurement is written twice, at i and i + size, so that the most recent n measurements
+# are always contiguous (at 16 bytes per value, or 32 bytes for (value, LTA)).
+# The array is an array.array (not numpy), since writing a few values at a time from Python
+# is much faster; RingChannel.window() returns a numpy view on it, if numpy is available.
+
+class RingChannel(_Statistics):
+
+    def __init__(self, size=250, columns=1, rolling=False):
+        """ A list of at most size measurements from an electrode on the headset.
+            For alpha and valence channels (columns=2), the list contains (value, LTA) tuples,
+            stored as two parallel arrays.
+            Once the list is full, new measurements overwrite the oldest ones.
+            With rolling=True, RingChannel.rolling has statistics over the measurements in the list.
+        """
+        self.size    = size
+        self.columns = columns
+        self._data   = [array("d", [0.0]) * (size * 2) for i in range(columns)]
+        self._i      = 0 # Next write position.
+        self._n      = 0 # Number of measurements (at most size).
+        self._reset(rolling)
+
+    def _write(self, a, values):
+        # Writes the given values at the next write position (and size further), wrapping around.
+        n = self.size
+        i = self._i
+        j = min(len(values), n - i)
+        a[i:i+j] = a[i+n:i+n+j] = values[:j]
+        a[0:len(values)-j] = a[n:n+len(values)-j] = values[j:]
+
+    def extend(self, values, lta=None):
+        """ Appends the given list of measurements (floats), and long-term averages for columns=2.
+        """
+        if self.columns > 1 and (lta is None or len(lta) != len(values)):
+            raise ValueError, "RingChannel.extend() with columns=2 needs an lta for each value"
+        self._evict(len(values))
+        self._count(values)
+        # New measurements beyond size are overwritten at once.
+        if self.rolling is not None:
+            self.rolling.remove(values[:-self.size])
+        values = array("d", values[-self.size:])
+        self._write(self._data[0], values)
+        if self.columns > 1:
+            self._write(self._data[1], array("d", lta[-self.size:]))
+        self._i = (self._i + len(values)) % self.size
+        self._n = min(self._n + len(values), self.size)
+
+    def push(self, v):
+        """ Appends the given measurement (float), or (value, LTA) tuple for columns=2.
+        """
+        i = self._i
+        n = self.size
+        if isinstance(v, tuple):
+            self._data[1][i] = self._data[1][i+n] = v[1]
+            v = v[0]
+        self._evict(1)
+        self._data[0][i] = self._data[0][i+n] = v
+        self._i = (i + 1) % n
+        self._n = min(self._n + 1, n)
+        self._count((v,))
+
+    def pop(self):
+        # The oldest measurements are overwritten, there is no need to pop.
+        pass
+
+    def trim(self, n):
+        # The list size is fixed, there is no need to trim.
+        pass
+
+    def _evict(self, n):
+        # Removes the oldest measurements that are overwritten by n new measurements
+        # from the rolling statistics.
+        if self.rolling is None:
+            return
+        n = min(self._n, self._n + n - self.size)
+        i = self._i + self.size - self._n # Oldest measurement.
+        if n == 1:
+            self.rolling.pop(self._data[0][i])
+        elif n > 1:
+            self.rolling.remove(self._data[0][i:i+n].tolist())
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError, "channel index out of range"
+        i += self._i + self.size - self._n
+        if self.columns > 1:
+            return (float(self._data[0][i]), float(self._data[1][i]))
+        return float(self._data[0][i])
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self[i]
+
+    def window(self, n=None, lta=False):
+        """ Returns an array with the most recent n values (by default, all), oldest-first.
+            For alpha and valence, with lta=True it contains the long-term averages instead.
+            With numpy, this is a read-only view on the channel (no copy),
+            which changes as new measurements are appended. Otherwise, it is a copy.
+        """
+        n = self._n if n is None else max(0, min(n, self._n))
+        i = self._i + self.size
+        a = self._data[int(bool(lta))]
+        if numpy is not None:
+            a = numpy.frombuffer(a, count=n, offset=(i-n) * a.itemsize)
+            a.flags.writeable = False
+            return a
+        return a[i-n:i]
+
+    def _value(self, i):
+        if i < 0:
+            i += self._n
+        return float(self._data[0][self._i + self.size - self._n + i])
+
+    @property
+    def current(self):
+        """ Returns the most recent value, or None.
+        """
+        if self._n > 0:
+            return self._value(-1)
+    
+    @property
+    def lta(self):
+        """ Yields the long-term average (for alpha and valence).
+        """
+        if self._n > 0 and self.columns > 1:
+            return float(self._data[1][self._i + self.size - 1])
+
+#--- BAND POWER --------------------------------------------------------------------------------------
+# The headset application computes alpha (and its LTA) from the RAW measurements.
+# BandPower does the same in Python, so that Headset.alpha can be filled without the application.
+# For each channel, it keeps a sliding window of RAW measurements. Every hop measurements,
+# it computes the power in the given frequency band with a DFT of the frequency bins in the band
+# (Hann-windowed), as one matrix product (numpy) or one map() per bin.
+# A longer window has a better frequency resolution (rate / window Hz), a shorter hop less latency.
+# The LTA is an exponential moving average with the given time constant (in seconds).
+
+class BandPower(object):
+
+    def __init__(self, rate=250, band=(8, 12), window=250, hop=25, lta=15.0):
+        """ Estimates the power in the given frequency band (by default, alpha waves, 8-12 Hz)
+            for RAW measurements sampled at the given rate (Hz).
+        """
+        self.rate   = rate
+        self.band   = band
+        self.window = window
+        self.hop    = hop
+        self.lta    = lta
+        self._state = {} # channel => [measurements, count since last hop, LTA]
+        # DFT coefficients for the bins in the band, multiplied with a Hann window.
+        n = window
+        w = [0.5 - 0.5 * math.cos(2 * math.pi * i / (n - 1)) for i in range(n)]
+        k1 = int(math.ceil(band[0] * float(n) / rate))
+        k2 = int(math.floor(band[1] * float(n) / rate))
+        self._dft  = []
+        for k in range(k1, k2 + 1):
+            self._dft.append([w[i] * math.cos(2 * math.pi * k * i / n) for i in range(n)])
+            self._dft.append([w[i] * math.sin(2 * math.pi * k * i / n) for i in range(n)])
+        if numpy is not None:
+            self._dft = numpy.array(self._dft)
+        # Normalize so that the power of a sine wave in the band is its mean square (A^2 / 2).
+        # The Hann window spreads the wave over 3 bins: 1 + 0.5^2 + 0.5^2.
+        self._norm = 4.0 / (3 * sum(w) ** 2)
+        # Weight of a new value in the LTA.
+        self._ema = 1 - math.exp(-float(hop) / (rate * lta))
+
+    def power(self, values):
+        """ Returns the power in the band for the given list of window measurements.
+        """
+        if numpy is not None:
+            y = self._dft.dot(values)
+            p = float(y.dot(y))
+        else:
+            p = 0.0
+            for a in self._dft:
+                y = sum(map(operator.mul, values, a))
+                p += y * y
+        return p * self._norm
+
+    def update(self, channel, values):
+        """ Appends the given list of RAW measurements for the given channel (0-7),
+            and returns a list of (power, LTA)-tuples, one for each hop completed.
+        """
+        if channel not in self._state:
+            self._state[channel] = [collections.deque(maxlen=self.window), 0, None]
+        s = self._state[channel]
+        a = []
+        i = 0
+        while i < len(values):
+            # Append measurements up to the next hop.
+            j = min(len(values), i + self.hop - s[1])
+            s[0].extend(values[i:j])
+            s[1] += j - i
+            i = j
+            if s[1] == self.hop:
+                s[1] = 0
+                if len(s[0]) == self.window:
+                    p = self.power(list(s[0]))
+                    s[2] = p if s[2] is None else s[2] + (p - s[2]) * self._ema
+                    a.append((p, s[2]))
+        return a
+
 #-----------------------------------------------------------------------------------------------------
 
+def _receive(socket, data, buffer):
+    # Reads the next datagram from the non-blocking socket into the given bytearray,
+    # which is 1 byte larger than the buffer size, to detect datagrams that are truncated.
+    # Returns a (size, address)-tuple, or (None, None) if there is nothing to read.
+    try:
+        n, address = socket.recvfrom_into(data)
+    except Exception, e:
+        if "larger than the internal message buffer" in str(e):
+            raise BufferError, "need more than %s bytes" % buffer
+        # Non-blocking has nothing to read, ignore.
+        #print e
+        return None, None
+    if n > buffer:
+        raise BufferError, "need more than %s bytes" % buffer
+    return n, address
+
+def _latest(socket, ring, buffer, limit=None, timeout=None, record=None):
+    # Reads pending datagrams into a ring of preallocated buffers (a list of bytearrays,
+    # reused between calls), so that only the most recent ones (at most limit) are kept,
+    # and decodes those newest-first (at least one). Reading and decoding take at most timeout seconds;
+    # datagrams that are still pending are read in the next call.
+    # Each datagram is passed to record(data, size) when it is received (e.g., Headset._record()).
+    # Returns a list of (address, blocks)-tuples (oldest-first) and the number discarded.
+    t = time.time()
+    m = []   # (size, address) for each buffer in the ring.
+    n = 0    # Number of datagrams read.
+    while n == 0 or timeout is None or time.time() - t < timeout:
+        i = n % limit if limit is not None else n
+        if i == len(ring):
+            # Without a limit, the ring grows to the number of datagrams read in one call.
+            ring.append(bytearray(buffer + 1))
+        size, address = _receive(socket, ring[i], buffer)
+        if size is None:
+            break
+        if record is not None:
+            record(ring[i], size)
+        if i == len(m):
+            m.append((size, address))
+        else:
+            m[i] = (size, address)
+        n += 1
+    a = []
+    for j in xrange(n - 1, n - 1 - len(m), -1):
+        if a and timeout is not None and time.time() - t > timeout:
+            break
+        i = j % len(m)
+        size, address = m[i]
+        a.append((address, decode(ring[i], size)))
+    a.reverse()
+    return a, n - len(a)
+
 class Headset:
 
-    def __init__(self, host="127.0.0.1", port=12002, history=250):
+    def __init__(self, host="127.0.0.1", port=12002, history=250, threaded=False, ring=False, bandpower=None):
         """ Interface to IMEC's EEG wireless headset.
             The headset application will stream data over a UPD socket.
             Headset.channels stores raw values from the headset's electrodes.
@@ -120,91 +646,176 @@ class Headset:
             (or vice versa depending on the person).
             Note: to measure relaxation (alpha), you can look at one channel instead of all of them.
             Relaxation will be noticeable on all eight electrodes.
+            With threaded=True, a background thread receives and decodes datagrams as they arrive,
+            and Headset.update() appends them to the channels (see Headset._run()).
+            With port=None, no socket is opened (see HeadsetProtocol).
+            With ring=True, channels are stored in fixed-size arrays (see RingChannel).
+            With bandpower=BandPower(), alpha is computed from the raw channels in Python,
+            and alpha values from the headset application are ignored.
         """
         # self.channel[0] is a list of int (maximum 250), newest-last.
         # self.alpha[0] is a list of (int, int), second int is long-term average.
         # self.valence is a list of (int, int), second int is long-term average.
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self._socket.bind((host, port))
-        self._socket.setblocking(0)
-        self.channel = [Channel() for i in range(8)]
-        self.alpha   = [Channel() for i in range(8)]
-        self.valence =  Channel()
+        self._socket = None
+        if port is not None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.bind((host, port))
+            self._socket.setblocking(0)
+        if ring:
+            self.channel = [RingChannel(history) for i in range(8)]
+            self.alpha   = [RingChannel(history, columns=2, rolling=True) for i in range(8)]
+            self.valence =  RingChannel(history, columns=2, rolling=True)
+        else:
+            self.channel = [Channel() for i in range(8)]
+            self.alpha   = [Channel(rolling=True) for i in range(8)]
+            self.valence =  Channel(rolling=True)
         self.history = history
+        self.bandpower = bandpower
+        self._buffer = None
+        self._thread = None
+        self.recorder = None
+        if threaded and self._socket is not None:
+            # Without a socket (port=None), there is nothing to receive.
+            self._start()
         
     @property
     def socket(self):
         return self._socket
         
-    def update(self, buffer=1024):
+    def update(self, buffer=1024, drain=False, limit=None, timeout=None):
         """ Read data streamed from the headset application.
+            By default, one datagram is read per call.
+            With drain=True, all pending datagrams are read, so that the data does not fall behind
+            when the headset application sends faster than update() is called.
+            With drain=True, at most the last limit datagrams are decoded (newest-first),
+            and reading and decoding take at most timeout seconds (datagrams still pending are read
+            in the next call); older datagrams are then discarded, so that the channels
+            hold the most recent data. Datagrams are received in a few preallocated buffers.
+            Returns a (received, dropped)-tuple with the number of datagrams decoded and discarded.
+            In threaded mode, the datagrams decoded since the last call are appended (no socket is read).
             Raises a BufferError if the buffer is too small:
             1 raw channel = 104 bytes, 1 alpha channel = 12 bytes, valence = 12 bytes,
             8 * 104 + 8 * 12 + 12 = 940
         """
-        try:
-            data = self._socket.recvfrom(buffer)
-            data = data[0].replace("#bundle:", "", 1)
-        except Exception, e:
-            if "larger than the internal message buffer" in str(e):
-                raise BufferError, "need more than %s bytes" % buffer
-            # Non-blocking has nothing to read, ignore.
-            #print e
-            return
+        if self._thread is not None:
+            return self._dequeue()
+        if self._buffer is None or len(self._buffer) != buffer + 1:
+            # One extra byte to detect datagrams that are truncated.
+            self._buffer = bytearray(buffer + 1)
+            self._ring = [self._buffer]
+        received = 0
+        dropped  = 0
+        if drain and (limit is not None or timeout is not None):
+            a, dropped = _latest(self._socket, self._ring, buffer, limit, timeout, record=self._record)
+            for address, blocks in a:
+                self._apply(blocks)
+            received = len(a)
+        else:
+            while True:
+                n = _receive(self._socket, self._buffer, buffer)[0]
+                if n is None:
+                    break
+                self._record(self._buffer, n)
+                self._feed(self._buffer, n)
+                received += 1
+                if not drain:
+                    break
+        if received > 0:
+            self._trim()
+        return received, dropped
+
+    def _start(self):
+        # The queue holds decoded datagrams, at most one per history entry
+        # (each datagram has at least one measurement per channel).
+        # If update() is not called for a long time, the oldest are discarded.
+        self._queue   = collections.deque(maxlen=self.history)
+        self._dropped = 0 # Number of datagrams discarded by the queue.
+        self._flushed = 0 # Number of discarded datagrams reported by update().
+        self._socket.settimeout(0.25)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        # The receiver thread blocks on the socket and decodes datagrams as they arrive.
+        # It never touches the channels, it only appends to the queue;
+        # Headset.update() pops from the queue and appends to the channels, in the drawing thread.
+        # Since deque.append() and deque.popleft() are atomic, no lock is needed,
+        # and the channels do not change while a frame is being drawn.
+        b = bytearray(65535) # Maximum datagram size.
+        while self._thread is not None:
+            try:
+                n = self._socket.recv_into(b)
+            except socket.timeout:
+                continue
+            except Exception, e:
+                # Socket closed.
+                break
+            if len(self._queue) == self._queue.maxlen:
+                self._dropped += 1
+            self._record(b, n)
+            self._queue.append(decode(b, n))
 
-        while len(data) > 0:
-            # The first 4 bytes is metadata:
-            # 1 byte is the type (RAW, ALPHA, VALENCE).
-            # 1 byte is the channel (0-7), corresponding to an electrode on the headset,
-            # 2 bytes is the length (number of readings for this channel),
-            type, channel, length = (
-                struct.unpack("B", data[0])[0],
-                struct.unpack("B", data[1])[0],
-                struct.unpack("<H", data[2:4])[0])
+    def _dequeue(self):
+        # Appends all datagrams decoded by the receiver thread to the channels.
+        received = 0
+        while len(self._queue) > 0:
+            self._apply(self._queue.popleft())
+            received += 1
+        if received > 0:
+            self._trim()
+        dropped = self._dropped - self._flushed
+        self._flushed += dropped
+        return received, dropped
 
+    def _feed(self, data, n=None):
+        # Appends the measurements in the given datagram to the channels.
+        self._apply(decode(data, n))
+
+    def _apply(self, blocks):
+        # Appends the given decoded (type, channel, values)-tuples to the channels.
+        for type, channel, values in blocks:
             if type == RAW:
-                # 4 bytes for each reading (signed int), which must be divided by 100,000.
-                for i in range(len(data[4:4+4*length])/4):
-                    r = struct.unpack("<i", data[4+4*i:4+4+4*i])[0]
-                    r = float(r) / 100000
-                    self.channel[channel].push(r)
-                data = data[4+4*length:]
-                
-            if type == ALPHA:
-                # 4 bytes is the Alpha-wave value.
-                # 4 bytes is the Alpha-wave LTA (long-term average).
-                a1, a2 = (
-                    struct.unpack("<i", data[4:8])[0],
-                    struct.unpack("<i", data[8:12])[0])
-                a1 = float(a1) / 100000
-                a2 = float(a2) / 100000
-                self.alpha[channel].push((a1,a2))              
-                data = data[12:]
-            
+                self.channel[channel].extend(values)
+                if self.bandpower is not None:
+                    for v in self.bandpower.update(channel, values):
+                        self.alpha[channel].push(v)
+            if type == ALPHA and self.bandpower is None:
+                self.alpha[channel].push(values)
             if type == VALENCE:
-                # 4 bytes is the valence.
-                # 4 bytes is the valence LTA (long-term average).
-                v1, v2 = (
-                    struct.unpack("<i", data[4:8])[0],
-                    struct.unpack("<i", data[8:12])[0])
-                v1 = float(v1) / 100000
-                v2 = float(v2) / 100000
-                self.valence.push((v1,v2))  
-                data = data[12:]
+                self.valence.push(values)
 
+    def _trim(self):
         m = self.history
         # Limit the list size of raw and alpha channels and valence.
         for i in range(8):
-            for j in range(len(self.channel[i]) - m):
-                self.channel[i].pop()
-            for j in range(len(self.alpha[i]) - m):
-                self.alpha[i].pop()
-        for j in range(len(self.valence) - m):
-            self.valence.pop()
+            self.channel[i].trim(m)
+            self.alpha[i].trim(m)
+        self.valence.trim(m)
+
+    def record(self, path):
+        """ Records all datagrams received from now on to the given file (see ReplayHeadset).
+        """
+        self.recorder = Recorder(path)
+        return self.recorder
+
+    def _record(self, data, n):
+        r = self.recorder
+        if r is not None:
+            r.write(data, n)
 
     def close(self):
-        self._socket.close()
-        self._socket = None
+        t, self._thread = self._thread, None
+        if t is not None:
+            # The receiver thread stops within its socket timeout (0.25s),
+            # after which it no longer writes to the recorder.
+            t.join(1.0)
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
         
     def __delete__(self):
         try: 
@@ -212,21 +823,289 @@ class Headset:
         except:
             pass
 
+#--- HEADSET POOL ------------------------------------------------------------------------------------
+# HeadsetPool receives datagrams from many headset applications on one socket,
+# and appends them to a Headset for each sender (e.g., one per visualization).
+
+class HeadsetPool(dict):
+
+    def __init__(self, host="127.0.0.1", port=12002, history=250, key=lambda address: address, **kwargs):
+        """ A dictionary of Headsets indexed by sender, which are created as datagrams arrive.
+            By default, the key of a sender is its (host, port)-tuple,
+            for example key=lambda address: address[0] uses the host.
+            Optional keyword arguments are passed to each new Headset (e.g., ring=True).
+        """
+        dict.__init__(self)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, port))
+        self._socket.setblocking(0)
+        self._buffer = None
+        self.history = history
+        self.key     = key
+        self.kwargs  = kwargs
+
+    @property
+    def socket(self):
+        return self._socket
+
+    def headset(self, key):
+        """ Returns the Headset for the given sender key (created if it does not exist).
+        """
+        if key not in self:
+            kwargs = dict(self.kwargs)
+            b = kwargs.get("bandpower")
+            if b is not None:
+                # Each Headset needs its own BandPower state.
+                kwargs["bandpower"] = BandPower(b.rate, b.band, b.window, b.hop, b.lta)
+            self[key] = Headset(port=None, history=self.history, **kwargs)
+        return self[key]
+
+    def update(self, buffer=1024, limit=None, timeout=None):
+        """ Reads all pending datagrams from all senders (see Headset.update() with drain=True).
+            Returns a (received, dropped)-tuple with the number of datagrams decoded and discarded.
+        """
+        if self._buffer is None or len(self._buffer) != buffer + 1:
+            self._buffer = bytearray(buffer + 1)
+            self._ring = [self._buffer]
+        received = 0
+        dropped  = 0
+        updated  = set()
+        if limit is not None or timeout is not None:
+            a, dropped = _latest(self._socket, self._ring, buffer, limit, timeout)
+            for address, blocks in a:
+                k = self.key(address)
+                self.headset(k)._apply(blocks)
+                updated.add(k)
+            received = len(a)
+        else:
+            while True:
+                n, address = _receive(self._socket, self._buffer, buffer)
+                if n is None:
+                    break
+                k = self.key(address)
+                self.headset(k)._feed(self._buffer, n)
+                updated.add(k)
+                received += 1
+        for k in updated:
+            self[k]._trim()
+        return received, dropped
+
+    def close(self):
+        """ Closes the socket and each Headset (e.g., to close their recorders).
+        """
+        for h in self.values():
+            h.close()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+#--- RECORDING ---------------------------------------------------------------------------------------
+# Headset.record() writes each datagram to a binary file, which ReplayHeadset reads back,
+# for example to run attractor.py without a headset, or to measure the decoder throughput.
+# The file starts with "VALENCE" + a 1 byte version number.
+# Each datagram is preceded by 12 bytes: a double with the time (in seconds since recording started)
+# and an unsigned int with the size of the datagram, so the file can be indexed in one pass.
+# The file is append-only: recording to an existing file continues after its last datagram
+# (a datagram that was only partly written, e.g., on a crash, is removed first).
+# On Python 2, there is no time.monotonic() and the clock falls back to time.time(),
+# which jumps if the system clock is adjusted. Timestamps are then kept from going backwards,
+# but a jump forward shows up as a pause in the replay.
+
+MAGIC  = "VALENCE\x01"
+RECORD = struct.Struct("<dI")
+
+try:
+    clock = time.monotonic
+except AttributeError:
+    clock = time.time
+
+def _last(path):
+    # Returns the time of the last datagram in the given recording (0.0 if none, None if no file),
+    # and removes a last datagram that is incomplete.
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    f = open(path, "r+b")
+    if f.read(len(MAGIC)) != MAGIC:
+        f.close()
+        raise ValueError, "%s is not a headset recording" % path
+    t = 0.0
+    i = len(MAGIC)
+    m = os.path.getsize(path)
+    while i < m:
+        f.seek(i)
+        r = f.read(RECORD.size)
+        if len(r) < RECORD.size or i + RECORD.size + RECORD.unpack(r)[1] > m:
+            f.truncate(i)
+            break
+        t, n = RECORD.unpack(r)
+        i += RECORD.size + n
+    f.close()
+    return t
+
+class Recorder(object):
+
+    def __init__(self, path):
+        """ Appends datagrams with a timestamp to the given file.
+            If the file exists, timestamps continue from its last datagram.
+        """
+        self.path = path
+        t = _last(path)
+        self._file = open(path, "ab")
+        if t is None:
+            self._file.write(MAGIC)
+            t = 0.0
+        self._t = clock() - t
+        self._previous = t
+
+    def write(self, data, n=None):
+        n = len(data) if n is None else n
+        t = max(self._previous, clock() - self._t)
+        self._previous = t
+        self._file.write(RECORD.pack(t, n))
+        self._file.write(memoryview(data)[:n])
+
+    def close(self):
+        self._file.close()
+
+class ReplayHeadset(Headset):
+
+    def __init__(self, path, realtime=True, loop=False, history=250, **kwargs):
+        """ A Headset that replays the datagrams recorded in the given file (see Headset.record()).
+            With realtime=True, Headset.update() appends the datagrams that were received
+            in the same time since the first update. Otherwise, it appends the next datagram
+            (or all of them, with drain=True), as fast as possible.
+            With loop=True, the recording restarts once it is finished.
+            Optional keyword arguments are passed to Headset (e.g., ring=True).
+        """
+        Headset.__init__(self, port=None, history=history, **kwargs)
+        self.path     = path
+        self.realtime = realtime
+        self.loop     = loop
+        self._file    = open(path, "rb")
+        self._map     = None
+        self.index    = [] # List of (time, offset, size)-tuples.
+        if os.path.getsize(path) > len(MAGIC):
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._map[:len(MAGIC)] != MAGIC:
+                raise ValueError, "%s is not a headset recording" % path
+            i = len(MAGIC)
+            while i + RECORD.size <= len(self._map):
+                t, n = RECORD.unpack_from(self._map, i)
+                i += RECORD.size
+                self.index.append((t, i, n))
+                i += n
+        self._i = 0    # Next datagram.
+        self._t = None # Clock time at the first update.
+
+    @property
+    def done(self):
+        return self._i >= len(self.index)
+
+    def update(self, buffer=1024, drain=False, limit=None, timeout=None):
+        """ Appends the next recorded datagrams to the channels.
+            Returns a (received, 0)-tuple with the number of datagrams appended.
+        """
+        if self.done and self.loop:
+            self._i = 0
+            self._t = None
+        if self._t is None:
+            self._t = clock()
+        t = clock() - self._t
+        received = 0
+        while not self.done and received != limit:
+            dt, i, n = self.index[self._i]
+            if self.realtime and dt > t:
+                break
+            self._feed(self._map[i:i+n])
+            self._i += 1
+            received += 1
+            if not self.realtime and not drain:
+                break
+        if received > 0:
+            self._trim()
+        return received, 0
+
+    def close(self):
+        Headset.close(self)
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+#--- ASYNCIO -----------------------------------------------------------------------------------------
+# HeadsetProtocol is an asyncio DatagramProtocol, to receive many headsets in one event loop:
+# loop = asyncio.get_event_loop()
+# transport, headset = loop.run_until_complete(listen(loop, port=12002))
+# Datagrams are decoded with the same decode() as Headset.update().
+
+class HeadsetProtocol(Headset):
+
+    def __init__(self, history=250, callback=None, queue=None, ring=False):
+        """ A Headset that is fed by an asyncio event loop instead of polling a socket.
+            Datagrams are decoded and appended to the channels as they arrive.
+            The given callback function takes a (headset, blocks)-tuple for each datagram.
+            The given queue (e.g., asyncio.Queue) receives the decoded blocks for each datagram,
+            a list of (type, channel, values)-tuples.
+        """
+        Headset.__init__(self, port=None, history=history, ring=ring)
+        self.transport = None
+        self.callback  = callback
+        self.queue     = queue
+        self._received = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self._record(data, len(data))
+        blocks = decode(data)
+        self._apply(blocks)
+        self._trim()
+        self._received += 1
+        if self.callback is not None:
+            self.callback(self, blocks)
+        if self.queue is not None:
+            self.queue.put_nowait(blocks)
+
+    def error_received(self, e):
+        pass
+
+    def connection_lost(self, e):
+        self.transport = None
+
+    def update(self, *args, **kwargs):
+        """ Returns a (received, 0)-tuple with the number of datagrams received since the last call.
+            The channels are updated by the event loop, so update() does not read anything.
+        """
+        received, self._received = self._received, 0
+        return received, 0
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.transport is not None:
+            self.transport.close()
+
+def listen(loop, host="127.0.0.1", port=12002, **kwargs):
+    """ Returns a coroutine for the given asyncio event loop,
+        that yields a (transport, HeadsetProtocol)-tuple bound to the given host and port.
+        Optional keyword arguments are passed to HeadsetProtocol (history, callback, queue, ring).
+    """
+    return loop.create_datagram_endpoint(lambda: HeadsetProtocol(**kwargs), local_addr=(host, port))
+
 #-----------------------------------------------------------------------------------------------------
 
 if __name__ == "__main__":
     
     from nodebox.graphics import *
 
-    def wave(channel, x, y, width, m=1.0, key=lambda v: v):
+    def wave(channel, x, y, width, m=1.0, lta=False):
         """ Draws a channel (e.g., Headset.channel[3]).
-            For alpha and valence channels (which are tuple), key defines the item to use,
-            for example: wave(Headset.valence, 0, 0, 100, key=v: v[0])
+            For alpha and valence channels, lta=True draws the long-term average,
+            for example: wave(Headset.valence, 0, 0, 100, lta=True)
         """
-        i = max(0, len(channel)-int(width))
         dy0 = y
-        for j in range(len(channel)-i):
-            dy1 = key(channel[i+j])
+        for j, dy1 in enumerate(channel.window(int(width), lta)):
             line(x+j, y+dy0*m, x+j+1, y+dy1*m)
             dy0 = dy1
 
@@ -243,7 +1122,7 @@ if __name__ == "__main__":
 
     def draw(canvas):
         global headset
-        headset.update(buffer=1024) # Poll the headset.
+        headset.update(buffer=1024, drain=True) # Poll the headset.
 
         background(1)
     
@@ -258,11 +1137,11 @@ if __name__ == "__main__":
                 continue
         
             stroke(0, 0, 1)
-            wave(headset.alpha[i], x=0, y=canvas.height/2, width=canvas.width, m=5.0, key=lambda a: a[0])
+            wave(headset.alpha[i], x=0, y=canvas.height/2, width=canvas.width, m=5.0)
         
             # The purple curve is the alpha long-term average (LTA):
             stroke(0.5, 0, 1)
-            wave(headset.alpha[i], x=0, y=canvas.height/2, width=canvas.width, m=5.0, key=lambda a: a[1])
+            wave(headset.alpha[i], x=0, y=canvas.height/2, width=canvas.width, m=5.0, lta=True)
         
             # The all-time average calculated in Python 
             # (horizontal blue line):
@@ -285,11 +1164,19 @@ if __name__ == "__main__":
             y = canvas.height / 2 + 5 * headset.alpha[i].max
             line(0, y, canvas.width, y)
 
+            # The rolling mean +- standard deviation of the alpha history 
+            # (horizontal light blue lines):
+            r = headset.alpha[i].rolling
+            stroke(0, 0.5, 1, 0.5)
+            for v in (r.mean - r.stdev, r.mean + r.stdev):
+                y = canvas.height / 2 + 5 * v
+                line(0, y, canvas.width, y)
+
         # Draw valence data (red curve + orange LTA).
         stroke(1, 0, 0)
-        wave(headset.valence, x=0, y=canvas.height/2, width=canvas.width, m=40.0, key=lambda v: v[0])
+        wave(headset.valence, x=0, y=canvas.height/2, width=canvas.width, m=40.0)
         stroke(1, 0.5, 0, 0.5)
-        wave(headset.valence, x=0, y=canvas.height/2, width=canvas.width, m=40.0, key=lambda v: v[1])
+        wave(headset.valence, x=0, y=canvas.height/2, width=canvas.width, m=40.0, lta=True)
 
     def stop(canvas):
         headset.close()
@@ -0,0 +1,140 @@
+#### CIRCLE PACKING ##################################################################################
+
+# Authors: Valence contributors, based on attractor.py by Tom De Smedt, Lieven Menschaert
+# License: GNU General Public License v3, see LICENSE.txt
+# Copyright (c) 2026 Valence contributors
+# All rights reserved.
+
+from math import sqrt
+
+from spatial import Grid, HALF
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+######################################################################################################
+
+#--- CIRCLE PACKING ----------------------------------------------------------------------------------
+# Particles attached to an attractor are packed around it with two forces:
+# an attractive force that pulls each particle to the attractor (proportional to its radius),
+# and a repulsive force that pushes intersecting particles apart (and away from the attractor).
+# Both only depend on the positions, so they can be computed for all particles at once (numpy),
+# or one pair at a time (Python).
+
+ATTRACT = 0.004
+REPULSE = 0.15
+
+def pack(particles, attractor, attract=ATTRACT, repulse=REPULSE, vectorized=True):
+    """ Sets the velocity (vx, vy) of the given particles, attached to the given attractor.
+        Particles and attractor have x, y and radius attributes, particles vx and vy.
+        With vectorized=False (or without numpy), the forces are computed one pair at a time.
+    """
+    if vectorized and numpy is not None and len(particles) > 0:
+        vx, vy = _forces(particles, attractor, attract, repulse)
+        for p, x, y in zip(particles, vx.tolist(), vy.tolist()):
+            p.vx = x
+            p.vy = y
+    else:
+        _pack(particles, attractor, attract, repulse)
+
+def _pairs(particles):
+    # Particles can only intersect if they are in the same or neighboring grid cells,
+    # where the cell size is the largest sum of two radii.
+    if len(particles) == 0:
+        return []
+    grid = Grid(particles, size=2 * max(p.radius for p in particles))
+    return grid.pairs()
+
+def _pack(particles, attractor, attract=ATTRACT, repulse=REPULSE):
+    # Attractive force: move all particles to attractor.
+    for p in particles:
+        f = p.radius * attract
+        vx = (p.x - attractor.x) * f
+        vy = (p.y - attractor.y) * f
+        p.vx = -vx
+        p.vy = -vy
+    # Repulsive force: move away from intersecting particles.
+    for p1, p2 in _pairs(particles) + [(p, attractor) for p in particles]:
+        dx = p2.x - p1.x
+        dy = p2.y - p1.y
+        d = sqrt(dx * dx + dy * dy)
+        r = p1.radius + p2.radius
+        if 0 < d < r - 0.01: # Particles at the same position have no direction to move apart.
+            vx = (dx / d) * (r-d) * repulse
+            vy = (dy / d) * (r-d) * repulse
+            p1.vx -= vx
+            p1.vy -= vy
+            if p2 != attractor:
+                p2.vx += vx
+                p2.vy += vy
+
+# Up to this number of particles, the distance between all pairs is computed (n x n matrix).
+# For more particles, only pairs in neighboring grid cells are considered.
+MATRIX = 250
+
+def _grid(x, y, size):
+    # Returns arrays (i, j) with the indices of the pairs of points in the same or neighboring cells
+    # (see spatial.Grid.pairs()). Points are sorted by cell, so that for each point the points in
+    # a neighboring cell are a range in the sorted order (found with a binary search).
+    cx = numpy.floor(x / size).astype(int)
+    cy = numpy.floor(y / size).astype(int)
+    cx -= cx.min()
+    cy -= cy.min()
+    h = cy.max() + 2
+    k = cx * h + cy # Cell (cx, cy) => unique number, cell (cx, cy+1) => +1, cell (cx+1, cy) => +h.
+    o = numpy.argsort(k, kind="mergesort")
+    s = k[o]
+    a, b = [], []
+    for dx, dy in ((0, 0),) + HALF:
+        t  = k + dx * h + dy
+        i1 = numpy.searchsorted(s, t, "left")
+        i2 = numpy.searchsorted(s, t, "right")
+        n  = i2 - i1
+        i  = numpy.repeat(numpy.arange(len(x)), n)
+        # For each point, the range i1 => i2 in the sorted order.
+        j  = o[numpy.repeat(i1 - numpy.cumsum(n) + n, n) + numpy.arange(n.sum())]
+        if dx == dy == 0:
+            i, j = i[i < j], j[i < j]
+        a.append(i)
+        b.append(j)
+    return numpy.concatenate(a), numpy.concatenate(b)
+
+def _forces(particles, attractor, attract=ATTRACT, repulse=REPULSE):
+    # Returns arrays with the velocity (vx, vy) of the given particles.
+    n = len(particles)
+    x = numpy.fromiter((p.x for p in particles), float, n)
+    y = numpy.fromiter((p.y for p in particles), float, n)
+    r = numpy.fromiter((p.radius for p in particles), float, n)
+    # Attractive force.
+    vx = (attractor.x - x) * r * attract
+    vy = (attractor.y - y) * r * attract
+    # Repulsive force between particles, for each (i, j) pair.
+    if n <= MATRIX:
+        i, j = numpy.triu_indices(n, 1)
+    else:
+        i, j = _grid(x, y, 2 * r.max())
+    dx = x[j] - x[i]
+    dy = y[j] - y[i]
+    d  = numpy.hypot(dx, dy)
+    rr = r[i] + r[j]
+    m  = (d > 0) & (d < rr - 0.01)
+    i, j, dx, dy, d, rr = i[m], j[m], dx[m], dy[m], d[m], rr[m]
+    f  = (rr - d) * repulse / d
+    fx = dx * f
+    fy = dy * f
+    vx -= numpy.bincount(i, fx, n)
+    vy -= numpy.bincount(i, fy, n)
+    vx += numpy.bincount(j, fx, n)
+    vy += numpy.bincount(j, fy, n)
+    # Repulsive force from the attractor.
+    dx = attractor.x - x
+    dy = attractor.y - y
+    d  = numpy.hypot(dx, dy)
+    rr = r + attractor.radius
+    m  = (d > 0) & (d < rr - 0.01)
+    f  = numpy.where(m, (rr - d) * repulse / numpy.where(m, d, 1), 0)
+    vx -= dx * f
+    vy -= dy * f
+    return vx, vy
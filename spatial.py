@@ -0,0 +1,92 @@
+#### SPATIAL HASH ####################################################################################
+
+# Authors: Valence contributors
+# License: GNU General Public License v3, see LICENSE.txt
+# Copyright (c) 2026 Valence contributors
+# All rights reserved.
+
+from math import floor, ceil
+
+######################################################################################################
+
+#--- GRID --------------------------------------------------------------------------------------------
+# A uniform grid that stores objects with an (x, y)-position in square cells.
+# Objects that are less than the cell size apart are in the same or in neighboring cells,
+# so that finding pairs of nearby objects takes O(n) instead of O(n^2) (if evenly spread out).
+
+# For each cell, neighbors to the right and above are enough to visit each pair of cells once.
+HALF = ((1, 0), (-1, 1), (0, 1), (1, 1))
+
+class Grid(dict):
+
+    def __init__(self, objects=[], size=50.0):
+        """ A dictionary of (i, j)-cells, each with a list of objects (with x and y attributes).
+            For Grid.pairs(), the size should be at least the largest distance of interest.
+        """
+        dict.__init__(self)
+        self.size = float(size)
+        self._extent = None # (i1, j1, i2, j2) of cells with objects.
+        for o in objects:
+            self.append(o)
+
+    def cell(self, x, y):
+        """ Returns the (i, j)-cell for the given position.
+        """
+        return (int(floor(x / self.size)), int(floor(y / self.size)))
+
+    def append(self, o):
+        k = self.cell(o.x, o.y)
+        if k in self:
+            self[k].append(o)
+        else:
+            self[k] = [o]
+        e = self._extent or k + k
+        self._extent = (min(e[0], k[0]), min(e[1], k[1]), max(e[2], k[0]), max(e[3], k[1]))
+
+    def nearby(self, x, y, d=None):
+        """ Returns a list of objects in the cells within distance d of the given position
+            (by default, the cell size), i.e., a superset of the objects within distance d.
+        """
+        n = int(ceil((d or self.size) / self.size))
+        i, j = self.cell(x, y)
+        a = []
+        for di in range(-n, n+1):
+            for dj in range(-n, n+1):
+                a.extend(self.get((i+di, j+dj), ()))
+        return a
+
+    def pairs(self):
+        """ Returns a list of (object1, object2)-tuples of objects in the same or neighboring cells,
+            i.e., a superset of the pairs of objects that are less than the cell size apart.
+            Each pair is listed once.
+        """
+        a = []
+        for (i, j), objects in self.iteritems():
+            for k, o1 in enumerate(objects):
+                for o2 in objects[k+1:]:
+                    a.append((o1, o2))
+            for di, dj in HALF:
+                for o2 in self.get((i+di, j+dj), ()):
+                    for o1 in objects:
+                        a.append((o1, o2))
+        return a
+
+    def nearest(self, o):
+        """ Returns the object nearest to the given object (that is not the object itself), or None.
+            Cells are searched in rings around the object's cell, until no nearer object is possible.
+        """
+        i, j = self.cell(o.x, o.y)
+        e = self._extent or (i, j, i, j)
+        m = max(i - e[0], j - e[1], e[2] - i, e[3] - j)
+        nn, d0 = None, None
+        for n in range(m + 1):
+            if d0 is not None and d0 <= ((n - 1) * self.size) ** 2:
+                # Objects in ring n are at least (n-1) * size away.
+                break
+            for di in range(-n, n+1):
+                for dj in (n == 0 or abs(di) == n) and range(-n, n+1) or (-n, n):
+                    for o2 in self.get((i+di, j+dj), ()):
+                        d = (o2.x - o.x) ** 2 + (o2.y - o.y) ** 2
+                        if o2 is not o and (d0 is None or d < d0):
+                            nn, d0 = o2, d
+        return nn
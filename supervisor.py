@@ -0,0 +1,180 @@
+#### VALENCE: SUPERVISOR ############################################################################
+
+# Authors: Valence contributors
+# License: GNU General Public License v3, see LICENSE.txt
+# Copyright (c) 2026 Valence contributors
+# All rights reserved.
+
+# Runs several worlds (see world.py), each in its own process, with its own headset.
+# Usage: python supervisor.py [worlds] [seconds]
+
+import time
+
+from multiprocessing import Process, Array
+from collections import namedtuple
+
+from world   import World, SLEEPIE, angle
+from headset import Headset, ReplayHeadset, clock
+
+######################################################################################################
+
+#--- SHARED STATE ------------------------------------------------------------------------------------
+# Each world runs in a separate process, so that several worlds do not share one Python interpreter
+# (and one GIL). After each step, the process writes the state of its world to shared memory,
+# an array of doubles: a header followed by the fields of each particle.
+# The drawing process reads it with Supervisor.state(i), which returns a (State, [Sprite])-tuple
+# (see SharedWorld in attractor.py, which draws it: python attractor.py --supervised).
+# The world processes load no images: particles refer to their image by index (see IMAGES),
+# and only the drawing process loads and blurs them (textures can't be shared between processes).
+
+HEADER = ("n", "frame", "zoom", "attracted", "repulsed", "x", "y", "radius", "gravity")
+FIELDS = ("x", "y", "radius", "alpha", "angle", "attached", "image", "type", "frames")
+
+State  = namedtuple("State", HEADER)
+Sprite = namedtuple("Sprite", FIELDS)
+
+# Particle images are stored by index (see World.image()).
+IMAGES = ["flower%i.png" % i for i in range(1,6+1)]
+
+# Each world is controlled with an array of integers:
+STOP, ATTRACT, SPAWN, MUTE = range(4)
+
+def _write(world, state, attracted=0, repulsed=0):
+    a = world.attractor
+    s = [len(world.particles), world.frame, world.zoom, attracted, repulsed, a.x, a.y, a.radius, a.gravity]
+    for p in world.particles[:(len(state) - len(HEADER)) // len(FIELDS)]:
+        s.extend((
+            p.x,
+            p.y,
+            p.radius,
+            p.alpha,
+            p.heading if p.parent is None else angle(p.x, p.y, p.parent.x, p.parent.y),
+            p.parent is not None,
+            IMAGES.index(p.image) if p.image in IMAGES else -1,
+            p.type == SLEEPIE,
+            p.frames))
+    s[0] = (len(s) - len(HEADER)) // len(FIELDS)
+    with state.get_lock():
+        state[:len(s)] = s
+
+def _read(state):
+    with state.get_lock():
+        h = state[:len(HEADER)]
+        n = int(h[0])
+        a = state[len(HEADER):len(HEADER) + n * len(FIELDS)]
+    h = State(*h)
+    a = [Sprite(*a[i:i+len(FIELDS)]) for i in range(0, len(a), len(FIELDS))]
+    return h, a
+
+#--- WORLD PROCESS -----------------------------------------------------------------------------------
+
+def _signals(headset, delay=0):
+    # Returns an (attract, spawn, delay)-tuple from the headset, as in attractor.py draw():
+    # attract when alpha is above average (+ 10 steps), spawn when valence is above average.
+    attract = delay > 0
+    if len(headset.alpha[0]) > 0 and headset.alpha[0][-1][0] > headset.alpha[0][-1][1] * 1.0:
+        attract = True
+        delay = 10
+    elif delay > 0:
+        delay -= 1
+    spawn = len(headset.valence) > 0 and headset.valence[-1][0] > headset.valence[-1][1]
+    return attract, spawn, delay
+
+def _run(state, control, n=40, seed=None, headset=None, width=1000, height=600):
+    # Runs a world with n particles until control[STOP] is set.
+    # The headset is a (host, port)-tuple or the path of a recorded session (or None).
+    world = World(width, height, seed=seed)
+    world.populate(n)
+    if isinstance(headset, tuple):
+        headset = Headset(*headset)
+    elif isinstance(headset, basestring):
+        headset = ReplayHeadset(headset, loop=True)
+    attracted = repulsed = delay = 0
+    t0 = clock()
+    while not control[STOP]:
+        t = clock()
+        attract = spawn = False
+        if headset is not None:
+            headset.update(buffer=1024, drain=True)
+            attract, spawn, delay = _signals(headset, delay)
+        attract = attract or bool(control[ATTRACT])
+        spawn = spawn or bool(control[SPAWN])
+        if control[MUTE]:
+            attract = spawn = False
+            delay = 0
+        world.advance(t - t0, attract, spawn)
+        t0 = t
+        for event, p in world.events:
+            attracted += event == "attract"
+            repulsed  += event == "repulse"
+        _write(world, state, attracted, repulsed)
+        time.sleep(max(0, 1.0 / world.rate - (clock() - t)))
+    if headset is not None:
+        headset.close()
+
+#--- SUPERVISOR --------------------------------------------------------------------------------------
+
+class Supervisor(list):
+
+    def __init__(self, worlds=2, particles=40, capacity=1000, seed=None, headsets=[], width=1000, height=600):
+        """ A list of processes, each running a world with the given number of particles
+            (and room for the given capacity), and the given headset:
+            a (host, port)-tuple, the path of a recorded session, or None.
+            With a seed, world i uses seed + i (so that the worlds are repeatable, but different).
+        """
+        list.__init__(self)
+        self._state   = []
+        self._control = []
+        for i in range(worlds):
+            s = Array("d", len(HEADER) + capacity * len(FIELDS))
+            c = Array("i", 4)
+            h = headsets[i] if i < len(headsets) else None
+            r = seed + i if seed is not None else None
+            self.append(Process(target=_run, args=(s, c, particles, r, h, width, height)))
+            self[-1].daemon = True
+            self._state.append(s)
+            self._control.append(c)
+
+    def start(self):
+        for p in self:
+            p.start()
+
+    def state(self, i):
+        """ Returns a (State, [Sprite])-tuple with the last state of world i.
+        """
+        return _read(self._state[i])
+
+    def control(self, i, attract=None, spawn=None, mute=None):
+        """ Forces attraction, spawning or mute in world i (e.g., from the keyboard).
+        """
+        for k, v in ((ATTRACT, attract), (SPAWN, spawn), (MUTE, mute)):
+            if v is not None:
+                self._control[i][k] = int(v)
+
+    def stop(self, timeout=1.0):
+        for c in self._control:
+            c[STOP] = 1
+        for p in self:
+            p.join(timeout)
+
+######################################################################################################
+
+if __name__ == "__main__":
+
+    # Runs the given number of worlds for the given number of seconds (attracting and spawning),
+    # and prints the number of steps per second in each world.
+    import sys
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+    t = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+
+    s = Supervisor(worlds=n, seed=0)
+    s.start()
+    for i in range(n):
+        s.control(i, attract=True, spawn=True)
+    time.sleep(t)
+    for i in range(n):
+        h, a = s.state(i)
+        print "world %s: %.1f steps/s, %s particles, %s attached" % (
+            i, h.frame / t, len(a), sum(p.attached for p in a))
+    s.stop()
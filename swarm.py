@@ -0,0 +1,281 @@
+#### PARTICLE SWARM ##################################################################################
+
+# Authors: Valence contributors
+# License: GNU General Public License v3, see LICENSE.txt
+# Copyright (c) 2026 Valence contributors
+# All rights reserved.
+
+# Requires numpy.
+
+import numpy
+
+from math import sqrt, atan2, degrees, radians, cos, sin
+
+######################################################################################################
+
+#--- SWARM -------------------------------------------------------------------------------------------
+# Each Particle in world.py is a Python object, updated one at a time in Particle.update().
+# A Swarm stores all particles in arrays (one array for x, one for y, one for radius, ...),
+# and updates them at once with the same rules: steering, speed decay, bounds, fade-in.
+# Arrays are compact: a removed particle is replaced by the last particle.
+# Swarm[i] returns a SwarmParticle, a view with the same attributes as Particle (x, y, vx, heading, ...),
+# so that the attractor and the circle packing work on either.
+# World(engine="swarm") simulates its particles with a Swarm.
+
+FIELDS = (
+    ("x"      , float),
+    ("y"      , float),
+    ("vx"     , float), # Velocity.
+    ("vy"     , float),
+    ("radius" , float),
+    ("speed"  , float),
+    ("steer"  , int  ), # Left (+1), right (-1), straight ahead (0).
+    ("alpha"  , float),
+    ("frames" , int  ), # Number of frames attached to attractor (< 0 = just released).
+    ("attached", bool),
+    ("bounded" , bool),
+    ("fading"  , bool), # Fades away when not attached (see World.step()).
+)
+
+class Swarm(object):
+
+    def __init__(self, capacity=100, seed=None, view=None):
+        """ A collection of particles stored in arrays, with room for the given number of particles
+            (which grows as needed). A seed makes the random steering repeatable.
+            The view is the class of the particles returned (by default, SwarmParticle).
+        """
+        self.n = 0
+        self.view = view or SwarmParticle
+        self.capacity = 0
+        self.bounds = numpy.zeros((0, 4)) # (left, bottom, right, top) for each particle.
+        for k, type in FIELDS:
+            setattr(self, k, numpy.zeros(0, dtype=type))
+        self.random = numpy.random.RandomState(seed)
+        self._views = []
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        for k, type in FIELDS:
+            a = numpy.zeros(capacity, dtype=type)
+            a[:self.n] = getattr(self, k)[:self.n]
+            setattr(self, k, a)
+        a = numpy.zeros((capacity, 4))
+        a[:self.n] = self.bounds[:self.n]
+        self.bounds = a
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        return self._views[:self.n][i]
+
+    def __iter__(self):
+        return iter(self._views[:self.n])
+
+    def append(self, x, y, radius=6, speed=2.0, angle=None, bounds=None, **kwargs):
+        """ Appends a particle with the given position, radius, speed and angle (random by default).
+            Returns a SwarmParticle with optional keyword arguments as attributes (e.g., image, type).
+        """
+        if self.n == self.capacity:
+            self._grow(max(self.capacity * 2, 16))
+        i = self.n
+        a = radians(self.random.uniform(0, 360) if angle is None else angle)
+        self.x[i]        = x
+        self.y[i]        = y
+        self.vx[i]       = speed * cos(a)
+        self.vy[i]       = speed * sin(a)
+        self.radius[i]   = radius
+        self.speed[i]    = speed
+        self.steer[i]    = 0
+        self.alpha[i]    = 0.0
+        self.frames[i]   = 0
+        self.attached[i] = False
+        self.bounded[i]  = bounds is not None
+        self.bounds[i]   = bounds or (0, 0, 0, 0)
+        self.fading[i]   = False
+        p = self.view(self, i, **kwargs)
+        self._views.append(p)
+        self.n += 1
+        return p
+
+    def remove(self, p):
+        """ Removes the given SwarmParticle (the last particle takes its place).
+        """
+        i, j = p._i, self.n - 1
+        for k, type in FIELDS:
+            a = getattr(self, k)
+            a[i] = a[j]
+        self.bounds[i] = self.bounds[j]
+        self._views[i] = self._views[j]
+        self._views[i]._i = i
+        self._views.pop()
+        self.n -= 1
+        p._i = None
+
+    def update(self, steering=0.9, zoom=1.0):
+        """ Updates the bearing and position of all particles (see Particle.update()).
+        """
+        n = self.n
+        x, y, vx, vy = self.x[:n], self.y[:n], self.vx[:n], self.vy[:n]
+        speed, attached, frames = self.speed[:n], self.attached[:n], self.frames[:n]
+        # Change steering direction now and then.
+        steer = self.steer[:n]
+        change = self.random.random_sample(n) > steering
+        steer[change] = self.random.randint(-1, 2, change.sum())
+        # Particles that are not attached move in a random direction.
+        # The velocity is recomputed from its angle and length (as Particle.heading does),
+        # rather than rotated, so that rounding errors do not add up to more than the speed.
+        a = numpy.radians(numpy.degrees(numpy.arctan2(vy, vx)) + steer)
+        m = numpy.sqrt(vx * vx + vy * vy)
+        vx[:], vy[:] = (
+            numpy.where(attached, vx, numpy.cos(a) * m),
+            numpy.where(attached, vy, numpy.sin(a) * m))
+        # Count frames attached, and frames since released (< 0).
+        frames += attached | (frames < 0)
+        # Speed of particles shot away from the attractor is reduced to its initial value.
+        m = numpy.hypot(vx, vy) > speed
+        vx[m] *= 0.5
+        vy[m] *= 0.5
+        x += vx
+        y += vy
+        self.constrain(zoom)
+        # Gradually make new particles appear.
+        numpy.minimum(self.alpha[:n] + 0.01, 1.0, self.alpha[:n])
+
+    def constrain(self, zoom=1.0):
+        """ Steers particles away from their (left, bottom, right, top)-bounds.
+        """
+        n = self.n
+        x, y, vx, vy, speed = self.x[:n], self.y[:n], self.vx[:n], self.vy[:n], self.speed[:n]
+        b = self.bounds[:n]
+        m = self.bounded[:n] & ((x < b[:,0]) | (y < b[:,1]) | (x > b[:,2]) | (y > b[:,3]))
+        if m.any():
+            vx += speed * m * ((x < b[:,0] * zoom) * 1.0 - (x > b[:,2] * zoom))
+            vy += speed * m * ((y < b[:,1] * zoom) * 1.0 - (y > b[:,3] * zoom))
+            d = numpy.hypot(vx, vy)
+            d = numpy.where(m & (d > 0), speed / numpy.where(d > 0, d, 1), 1.0)
+            vx *= d
+            vy *= d
+
+    def distance(self, x, y):
+        """ Returns an array with the distance of each particle to the given point.
+        """
+        return numpy.hypot(self.x[:self.n] - x, self.y[:self.n] - y)
+
+    def within(self, x, y, radius, limit=210):
+        """ Returns a list of the SwarmParticles that are not attached, visible and not just released,
+            with a distance to the given point smaller than their radius + the given radius (< limit).
+        """
+        n = self.n
+        d = self.distance(x, y)
+        m = ~self.attached[:n] & (self.frames[:n] >= 0) & (self.alpha[:n] >= 0.25)
+        m &= d < numpy.minimum(limit, self.radius[:n] + radius)
+        return [self._views[i] for i in numpy.flatnonzero(m)]
+
+#--- SWARM PARTICLE ----------------------------------------------------------------------------------
+
+def _field(k, type=float):
+    def get(self):
+        return type(getattr(self.swarm, k)[self._i])
+    def set(self, v):
+        getattr(self.swarm, k)[self._i] = v
+    return property(get, set)
+
+class SwarmVelocity(object):
+
+    def __init__(self, particle):
+        """ The velocity of a SwarmParticle, with x, y, length and angle (in degrees) as Vector.
+        """
+        self.particle = particle
+
+    def _get(self):
+        p = self.particle
+        return p.swarm.vx[p._i], p.swarm.vy[p._i]
+
+    def _set(self, vx, vy):
+        p = self.particle
+        p.swarm.vx[p._i] = vx
+        p.swarm.vy[p._i] = vy
+
+    def _get_x(self):
+        return float(self._get()[0])
+    def _set_x(self, v):
+        self._set(v, self._get()[1])
+    x = property(_get_x, _set_x)
+
+    def _get_y(self):
+        return float(self._get()[1])
+    def _set_y(self, v):
+        self._set(self._get()[0], v)
+    y = property(_get_y, _set_y)
+
+    def _get_length(self):
+        vx, vy = self._get()
+        return sqrt(vx * vx + vy * vy)
+    def _set_length(self, v):
+        a = radians(self.angle)
+        self._set(v * cos(a), v * sin(a))
+    length = property(_get_length, _set_length)
+
+    def _get_angle(self):
+        vx, vy = self._get()
+        return degrees(atan2(vy, vx))
+    def _set_angle(self, v):
+        n = self.length
+        self._set(n * cos(radians(v)), n * sin(radians(v)))
+    angle = property(_get_angle, _set_angle)
+
+class SwarmParticle(object):
+
+    def __init__(self, swarm, i, parent=None, **kwargs):
+        """ A view on the particle at index i in the given Swarm.
+        """
+        self.swarm  = swarm
+        self._i     = i
+        self.v      = SwarmVelocity(self)
+        self.parent = parent
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+    x      = _field("x")
+    y      = _field("y")
+    vx     = _field("vx")
+    vy     = _field("vy")
+    radius = _field("radius")
+    alpha  = _field("alpha")
+    frames = _field("frames", int)
+    fading = _field("fading", bool)
+
+    def _get_heading(self):
+        return self.v.angle
+    def _set_heading(self, v):
+        self.v.angle = v
+    heading = property(_get_heading, _set_heading)
+
+    def _get_magnitude(self):
+        return self.v.length
+    def _set_magnitude(self, v):
+        self.v.length = v
+    magnitude = property(_get_magnitude, _set_magnitude)
+
+    def _get_speed(self):
+        return float(self.swarm.speed[self._i])
+    def _set_speed(self, v):
+        self.swarm.speed[self._i] = self.v.length = v
+    speed = property(_get_speed, _set_speed)
+
+    def _get_parent(self):
+        return self._parent
+    def _set_parent(self, v):
+        self._parent = v
+        self.swarm.attached[self._i] = v is not None
+    parent = property(_get_parent, _set_parent)
+
+    def _get_bounds(self):
+        if self.swarm.bounded[self._i]:
+            return tuple(self.swarm.bounds[self._i])
+    def _set_bounds(self, v):
+        self.swarm.bounded[self._i] = v is not None
+        self.swarm.bounds[self._i] = v or (0, 0, 0, 0)
+    bounds = property(_get_bounds, _set_bounds)
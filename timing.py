@@ -0,0 +1,151 @@
+#### FRAME TIMING ####################################################################################
+
+# Authors: Valence contributors
+# License: GNU General Public License v3, see LICENSE.txt
+# Copyright (c) 2026 Valence contributors
+# All rights reserved.
+
+import time
+import json
+
+from collections import deque
+from math import ceil
+
+try:
+    clock = time.monotonic
+except AttributeError:
+    clock = time.time
+
+######################################################################################################
+
+#--- PROFILER ----------------------------------------------------------------------------------------
+# A Profiler measures the time spent in each stage of a frame (e.g., "headset", "physics", "halo"):
+#
+#   with profiler("physics"):
+#       attractor.update()
+#   profiler.frame()
+#
+# It keeps the timings of the last n frames, from which percentiles are calculated on demand
+# (e.g., a p99 of 12ms for "halo" means that 1 in 100 frames spends more than 12ms in the halo).
+# The timings can be exported to a CSV-file (one row per frame) or a JSON-file (summary + frames).
+
+PERCENTILES = (50, 95, 99)
+
+class Timer(object):
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+        self.t = 0.0
+
+    def __enter__(self):
+        self.t = clock()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.add(self.stage, clock() - self.t)
+
+class NoTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+class Profiler(object):
+
+    def __init__(self, n=600, enabled=True):
+        """ Records the time spent in each stage (in seconds) for the last n frames.
+        """
+        self.enabled = enabled
+        self.stages = [] # Stage names, in the order in which they were first timed.
+        self.frames = deque(maxlen=n)
+        self._frame = {}
+        self._timers = {}
+        self._t = None
+        self._none = NoTimer()
+
+    def __call__(self, stage):
+        """ Returns a timer for the given stage, to be used in a with-statement.
+        """
+        if not self.enabled:
+            return self._none
+        if stage not in self._timers:
+            self._timers[stage] = Timer(self, stage)
+        return self._timers[stage]
+
+    def add(self, stage, t):
+        """ Adds t seconds to the given stage in the current frame.
+        """
+        if stage not in self._frame:
+            self._frame[stage] = 0.0
+            if stage not in self.stages:
+                self.stages.append(stage)
+        self._frame[stage] += t
+
+    def frame(self):
+        """ Ends the current frame. The time since the previous call is recorded as the "frame" stage.
+        """
+        t = clock()
+        if self.enabled:
+            if self._t is not None:
+                self._frame["frame"] = t - self._t
+            self.frames.append(self._frame)
+        self._frame = {}
+        self._t = t
+
+    def timings(self, stage):
+        """ Returns a list of timings (in seconds) for the given stage in the recorded frames.
+        """
+        if stage == "frame":
+            return [f["frame"] for f in self.frames if "frame" in f] # Not in the first frame.
+        return [f.get(stage, 0.0) for f in self.frames]
+
+    def percentile(self, stage, p=50):
+        """ Returns the p-th percentile (0-100) of the timings for the given stage.
+        """
+        return percentile(sorted(self.timings(stage)), p)
+
+    def summary(self, percentiles=PERCENTILES):
+        """ Returns a list of (stage, mean, p50, p95, p99)-tuples (in seconds),
+            with "frame" (the total frame time) last.
+        """
+        a = []
+        for stage in self.stages + ["frame"]:
+            v = sorted(self.timings(stage))
+            a.append((stage, sum(v) / (len(v) or 1)) + tuple(percentile(v, p) for p in percentiles))
+        return a
+
+    def lines(self, percentiles=PERCENTILES):
+        """ Returns a list of strings with the summary in milliseconds (e.g., for an overlay).
+        """
+        s = ["%-10s%7s" % ("ms", "mean") + "".join("%7s" % ("p%s" % p) for p in percentiles)]
+        for row in self.summary(percentiles):
+            s.append("%-10s" % row[0] + "".join("%7.2f" % (v * 1000) for v in row[1:]))
+        return s
+
+    def save(self, path):
+        """ Exports the timings (in milliseconds) to the given .csv or .json file.
+        """
+        stages = self.stages + ["frame"]
+        f = open(path, "w")
+        if path.endswith(".json"):
+            json.dump({
+                "summary": [dict(zip(("stage", "mean") + tuple("p%s" % p for p in PERCENTILES),
+                                     (row[0],) + tuple(v * 1000 for v in row[1:])))
+                                         for row in self.summary()],
+                 "frames": [dict((k, v * 1000) for k, v in frame.items()) for frame in self.frames]
+            }, f, indent=1)
+        else:
+            f.write(",".join(stages) + "\n")
+            for frame in self.frames:
+                f.write(",".join("%.3f" % (frame.get(k, 0.0) * 1000) for k in stages) + "\n")
+        f.close()
+
+def percentile(values, p=50):
+    """ Returns the p-th percentile (0-100) of the given sorted list (nearest rank), or 0.0.
+    """
+    if len(values) == 0:
+        return 0.0
+    return values[max(0, min(len(values) - 1, int(ceil(p / 100.0 * len(values))) - 1))]
@@ -1,4 +1,6 @@
 import socket
+import threading
+import time
 
 class UDP:
     
@@ -7,13 +9,107 @@ class UDP:
         self.port = port
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.connect((host, port))
+        self.sent   = 0    # Number of messages sent.
+        self.errors = 0    # Number of messages that failed.
+        self.error  = None # The last exception.
         
     def send(self, message):
         try:
             self.socket.send(str(message))
-            #print "'%s' sent" % message
+            self.sent += 1
         except Exception, e:
-            print e
+            self.errors += 1
+            self.error = e
     
     def close(self):
-        self.socket.close()
\ No newline at end of file
+        self.socket.close()
+
+class CoalescingUDP(UDP):
+
+    def __init__(self, host, port, threshold=1.0, interval=1.0, format="%.2f"):
+        """ A UDP sender for a value that changes gradually (e.g., a dimmer level), e.g.:
+            dimmer = CoalescingUDP("10.0.1.2", 7000)
+            dimmer.send(DIM * 100)
+            A value is sent only if it differs from the last value sent by at least the threshold,
+            otherwise it is skipped (but the latest value is sent every interval seconds, as keepalive).
+            Messages are formatted and sent in a background thread, so that send() does not block.
+        """
+        UDP.__init__(self, host, port)
+        self.threshold = threshold
+        self.interval  = interval
+        self.format    = format
+        self.skipped   = 0 # Number of values within the threshold of the last value sent.
+        self._value    = None # Latest value.
+        self._last     = None # Last value sent.
+        self._time     = 0.0  # Time of the last message sent.
+        self._closed   = False
+        self._event    = threading.Event()
+        self._thread   = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, value):
+        self._value = value
+        if self._last is None or abs(value - self._last) >= self.threshold:
+            self._event.set()
+        else:
+            self.skipped += 1
+
+    def _run(self):
+        while not self._closed:
+            self._event.wait(self.interval)
+            self._event.clear()
+            self.flush()
+
+    def flush(self):
+        """ Sends the latest value, if it changed or if the keepalive is due.
+        """
+        v = self._value
+        if v is None:
+            return
+        if self._last is None or abs(v - self._last) >= self.threshold \
+         or time.time() - self._time >= self.interval:
+            self._last = v
+            self._time = time.time()
+            UDP.send(self, self.format % v)
+
+    def close(self):
+        self._closed = True
+        self._event.set()
+        self._thread.join(1.0)
+        UDP.close(self)
+
+class UDPProtocol(object):
+
+    def __init__(self):
+        """ An asyncio DatagramProtocol counterpart of UDP, e.g.:
+            transport, dimmer = loop.run_until_complete(connect(loop, "10.0.1.2", 7000))
+            UDPProtocol.send() does not block; messages are discarded until connected.
+        """
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        pass
+
+    def error_received(self, e):
+        pass
+
+    def connection_lost(self, e):
+        self.transport = None
+
+    def send(self, message):
+        if self.transport is not None:
+            self.transport.sendto(str(message))
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+def connect(loop, host, port):
+    """ Returns a coroutine for the given asyncio event loop,
+        that yields a (transport, UDPProtocol)-tuple connected to the given host and port.
+    """
+    return loop.create_datagram_endpoint(UDPProtocol, remote_addr=(host, port))
\ No newline at end of file
@@ -0,0 +1,594 @@
+#### VALENCE: SIMULATION #############################################################################
+
+# Authors: Valence contributors, based on attractor.py by Tom De Smedt, Lieven Menschaert
+# License: GNU General Public License v3, see LICENSE.txt
+# Copyright (c) 2026 Valence contributors
+# All rights reserved.
+
+# The particles and the attractor in attractor.py, without drawing (i.e., without NodeBox),
+# so that the simulation runs headless, e.g., for benchmarks and regression tests.
+# Usage: python world.py [frames] [particles] [seed] [engine]
+
+from math   import sqrt, atan2, degrees, radians, cos, sin, floor
+from random import Random
+from hashlib import md5
+
+from packing import pack
+from timing  import Profiler
+
+try:
+    # World(engine="swarm") requires numpy.
+    import numpy
+    from swarm import Swarm, SwarmParticle
+except ImportError:
+    numpy = Swarm = SwarmParticle = None
+
+######################################################################################################
+
+#--- RANDOM ------------------------------------------------------------------------------------------
+# The same as NodeBox random(), with a generator that can be seeded to repeat a simulation.
+
+_rnd = Random()
+
+def seed(x=None):
+    _rnd.seed(x)
+
+_RANDOM_MAP = [90.0, 9.00, 4.00, 2.33, 1.50, 1.00, 0.66, 0.43, 0.25, 0.11, 0.01]
+def _rnd_exp(bias=0.5):
+    bias = max(0, min(bias, 1)) * 10
+    i = int(floor(bias))             # bias*10 => index in the _map curve.
+    n = _RANDOM_MAP[i]               # If bias is 0.3, rnd()**2.33 will average 0.3.
+    if bias < 10:
+        n += (_RANDOM_MAP[i+1]-n) * (bias-i)
+    return n
+
+def random(v1=1.0, v2=None, bias=None):
+    """ Returns a number between v1 and v2, including v1 but not v2.
+        The bias (0.0-1.0) represents preference towards lower or higher numbers.
+    """
+    if v2 is None:
+        v1, v2 = 0, v1
+    if bias is None:
+        r = _rnd.random()
+    else:
+        r = _rnd.random()**_rnd_exp(bias)
+    x = r * (v2-v1) + v1
+    if isinstance(v1, int) and isinstance(v2, int):
+        x = int(x)
+    return x
+
+def choice(list, bias=None):
+    i = random(len(list), bias=bias)
+    return list[i]
+
+#--- GEOMETRY ----------------------------------------------------------------------------------------
+
+def angle(x0, y0, x1, y1):
+    """ Returns the angle between two points.
+    """
+    return degrees(atan2(y1-y0, x1-x0))
+
+def distance(x0, y0, x1, y1):
+    """ Returns the distance between two points.
+    """
+    return sqrt(pow(x1-x0, 2) + pow(y1-y0, 2))
+
+class Vector(object):
+
+    def __init__(self, x=0, y=0, length=None, angle=None):
+        """ A 2D vector with a direction (angle in degrees) and a magnitude (length),
+            the same as NodeBox physics.Vector.
+        """
+        self.x = float(x)
+        self.y = float(y)
+        if length is not None:
+            self.length = length
+        if angle is not None:
+            self.angle = angle
+
+    def _get_length(self):
+        return sqrt(self.x**2 + self.y**2)
+    def _set_length(self, n):
+        d = self.length or 1
+        self.x *= n/d
+        self.y *= n/d
+    length = property(_get_length, _set_length)
+
+    def _get_angle(self):
+        return degrees(atan2(self.y, self.x))
+    def _set_angle(self, degrees):
+        d = self.length
+        self.x = cos(radians(degrees)) * d
+        self.y = sin(radians(degrees)) * d
+    angle = property(_get_angle, _set_angle)
+
+class Velocity(object):
+
+    __slots__ = ("particle",)
+
+    def __init__(self, particle):
+        """ The velocity of a Particle, with x, y, length and angle (in degrees) as Vector.
+        """
+        self.particle = particle
+
+    def _get_x(self):
+        return self.particle.vx
+    def _set_x(self, v):
+        self.particle.vx = v
+        self.particle._heading = None
+    x = property(_get_x, _set_x)
+
+    def _get_y(self):
+        return self.particle.vy
+    def _set_y(self, v):
+        self.particle.vy = v
+        self.particle._heading = None
+    y = property(_get_y, _set_y)
+
+    def _get_length(self):
+        return self.particle.magnitude
+    def _set_length(self, n):
+        self.particle.magnitude = n
+    length = property(_get_length, _set_length)
+
+    def _get_angle(self):
+        return self.particle.heading
+    def _set_angle(self, degrees):
+        self.particle.heading = degrees
+    angle = property(_get_angle, _set_angle)
+
+#--- PARTICLE ----------------------------------------------------------------------------------------
+
+# Feelies only appear when valence is high:
+SLEEPIE, FEELIE = \
+    "sleepie", "feelie"
+
+# Maximum number of particles on the canvas.
+# Attractor.update() uses a grid to find intersecting particles, so it scales to thousands.
+MAX_PARTICLES = 80
+
+# Particles have __slots__ instead of a __dict__, and store their velocity as vx and vy.
+# The heading (in degrees) and magnitude of the velocity are cached, so that a roaming particle
+# does not recompute its heading (atan2) every frame. The magnitude is still measured (sqrt)
+# after each turn, as with Vector: the rounding error can exceed Particle.speed, which halves the speed
+# (see Particle.update()), and the simulation was tuned with this behavior.
+# The cache is kept up to date by the heading and magnitude properties,
+# and by Particle.v (a Vector-like view on vx and vy, for compatibility).
+# Attached particles are moved by the attractor, which sets their vx and vy directly (see packing.py),
+# so for attached particles the heading and the magnitude are always recomputed.
+# Subclasses should declare __slots__ too (e.g., __slots__ = ()), or they will have a __dict__.
+
+class Particle(object):
+
+    __slots__ = (
+        "parent", "x", "y", "vx", "vy", "_heading", "_magnitude", "radius",
+        "_steer", "_speed", "image", "bounds", "frames", "alpha", "type"
+    )
+
+    def __init__(self, x, y, radius=6, speed=2.0, image=None, parent=None, bounds=None, type=FEELIE):
+        """ A particle that roams around freely if it does not have a parent.
+        """
+        self.parent = parent
+        self.x      = x
+        self.y      = y
+        self.vx     = 1.0
+        self.vy     = 1.0
+        self._heading   = None # Cached velocity angle (None = recompute).
+        self._magnitude = None # Cached velocity length.
+        self.magnitude  = speed
+        self.heading    = random(360)
+        self.radius = radius
+        self._steer = 0 # Left (+1), right (-1), straigh ahead (0).
+        self._speed = speed
+        self.image  = image
+        self.bounds = bounds
+        self.frames = 0 # Number of frames attached to Attractor.
+        self.alpha  = 0.0
+        self.type   = type
+
+    def _polar(self):
+        self._heading   = degrees(atan2(self.vy, self.vx))
+        self._magnitude = sqrt(self.vx * self.vx + self.vy * self.vy)
+
+    def _get_heading(self):
+        if self._heading is None or self.parent is not None:
+            self._polar()
+        return self._heading
+    def _set_heading(self, degrees):
+        m = self.magnitude
+        self.vx = cos(radians(degrees)) * m
+        self.vy = sin(radians(degrees)) * m
+        self._heading = degrees
+        self._magnitude = sqrt(self.vx * self.vx + self.vy * self.vy)
+    heading = property(_get_heading, _set_heading)
+
+    def _get_magnitude(self):
+        if self._heading is None or self.parent is not None:
+            self._polar()
+        return self._magnitude
+    def _set_magnitude(self, n):
+        m = self.magnitude
+        self.vx *= n / (m or 1)
+        self.vy *= n / (m or 1)
+        self._magnitude = sqrt(self.vx * self.vx + self.vy * self.vy)
+        if n < 0:
+            self._heading = None
+    magnitude = property(_get_magnitude, _set_magnitude)
+
+    @property
+    def v(self):
+        return Velocity(self)
+
+    def _get_speed(self):
+        return self._speed
+    def _set_speed(self, v):
+        self._speed = self.magnitude = v
+    speed = property(_get_speed, _set_speed)
+
+    def constrain(self, zoom=1.0):
+        """ Steer away from the (left, bottom, right, top)-bounds.
+        """
+        b = self.bounds
+        if b and (self.x < b[0] or self.y < b[1] or self.x > b[2] or self.y > b[3]):
+            m = self._speed
+            if self.x < b[0]*zoom: self.vx += m
+            if self.y < b[1]*zoom: self.vy += m
+            if self.x > b[2]*zoom: self.vx -= m
+            if self.y > b[3]*zoom: self.vy -= m
+            d = sqrt(self.vx * self.vx + self.vy * self.vy) or 1
+            self.vx *= m / d
+            self.vy *= m / d
+            self._heading = None
+
+    def update(self, steering=0.9, zoom=1.0):
+        """ Update the particle's bearing and position.
+        """
+        if random() > steering:
+            self._steer = choice((-1, 0, 1))
+        if self.parent is None:
+            # Not attached to an attractor, move in a random direction.
+            if self._heading is None:
+                self._polar()
+            self._heading += self._steer
+            self.vx = cos(radians(self._heading)) * self._magnitude
+            self.vy = sin(radians(self._heading)) * self._magnitude
+            m = self._magnitude = sqrt(self.vx * self.vx + self.vy * self.vy)
+            if self.frames < 0:
+                # Particle.framses can be lower than zero.
+                # This indicates that has just been released by the attractor.
+                self.frames += 1
+        else:
+            m = sqrt(self.vx * self.vx + self.vy * self.vy)
+            self.frames += 1
+        # Speed of particles shot away from the attractor.
+        # Reduce to its initialized value
+        if m > self._speed:
+            self.vx *= 0.5
+            self.vy *= 0.5
+            self._magnitude *= 0.5
+        self.x += self.vx
+        self.y += self.vy
+        self.constrain(zoom)
+        # Gradually make new particles appear.
+        self.alpha += 0.01
+        self.alpha = min(self.alpha, 1.0)
+
+#--- ATTRACTOR ---------------------------------------------------------------------------------------
+
+class Attractor(Particle):
+
+    def __init__(self, *args, **kwargs):
+        """ A particle that attracts other particles and keeps them packed around itself.
+        """
+        Particle.__init__(self, *args, **kwargs)
+        self.particles = []
+
+    @property
+    def gravity(self):
+        # Used to influence the attraction radius.
+        # For example, we could increase this based on alpha wave values.
+        return 1.0 + len(self.particles) * 0.125
+
+    def append(self, particle):
+        """ Appends the particle to the attractor.
+            It will then use circle packing forces instead of its own roaming.
+        """
+        self.particles.append(particle)
+        particle.parent = self
+        particle.vx = 0.0
+        particle.vy = 0.0
+
+    def remove(self, particle):
+        # Speed is set to Attractor.radius * Attractor.gravity to shoot away.
+        particle.heading = angle(self.x, self.y, particle.x, particle.y)
+        particle.magnitude = self.radius * self.gravity * 1.0
+        particle.parent = None
+        particle.frames = -10 # Take some time to escape attraction radius.
+        self.particles.remove(particle)
+
+    def update(self, x=500, y=300, zoom=1.0):
+        """ Attractor roams around and sucks in particles
+        """
+        Particle.update(self, zoom=zoom)
+
+        # Attractor wants to be in the center (x, y) of the canvas.
+        # This urge increases as its gravity (i.e., number of attached particles) increases.
+        vx = self.x - x
+        vy = self.y - y
+        f = 0.0015 * self.gravity**2
+        self.x -= vx * f
+        self.y -= vy * f
+
+        # Attractive force: move all particles to attractor.
+        # Repulsive force: move away from intersecting particles.
+        # See packing.py (with numpy, this is computed for all particles at once).
+        pack(self.particles, self, attract=0.004, repulse=0.15)
+
+#--- WORLD -------------------------------------------------------------------------------------------
+# The world has a canvas size, a zoom factor, the particles and the attractor.
+# World.step() advances the simulation by one frame (a fixed timestep),
+# given the state of the headset: attraction (alpha above average) and spawning (valence above average).
+# Sounds are not played in the world, instead World.events lists what happened during the last step.
+# The particle images are looked up by name in World.images (by default, the image is the name).
+# In attractor.py, a subclass of World creates particles (with a draw() method) with NodeBox images.
+#
+# With engine="swarm", the particles are stored in a Swarm (see swarm.py) and updated all at once (numpy),
+# instead of one Particle.update() at a time. World.particles is then a list of SwarmParticle views.
+# The rules are the same, but the random numbers (steering) differ, and during a step the attraction
+# radius grows only with the particles attached in that step, not in between.
+#
+# All constants (forces, zoom step, fade in) are per step, so the simulation should take
+# the same number of steps per second regardless of the frame rate of the display.
+# World.advance() takes as many steps of 1/World.rate seconds as fit in the time since the last frame.
+# Between steps, World.interpolate() moves the particles in between their previous and current position,
+# so that the animation is smooth even if the display is faster than the simulation.
+# World.profiler times the "particles" and the "attractor" stage of each step (see timing.py);
+# by default it is disabled, attractor.py replaces it with the profiler of the frame.
+
+class World(object):
+
+    Particle      = Particle
+    SwarmParticle = SwarmParticle
+    Attractor     = Attractor
+
+    def __init__(self, width=1000, height=600, images=None, seed=None, engine="python"):
+        """ A simulation of particles and an attractor on a canvas of the given size.
+            A seed makes the simulation repeatable.
+            With engine="swarm", the particles are updated with numpy (see swarm.py).
+        """
+        if seed is not None:
+            _rnd.seed(seed)
+        if engine == "swarm" and Swarm is None:
+            raise ImportError, "World(engine='swarm') requires numpy"
+        if engine not in ("python", "swarm"):
+            raise ValueError, "engine must be 'python' or 'swarm'"
+        self.width     = width
+        self.height    = height
+        self.images    = images
+        self.engine    = engine
+        self.swarm     = Swarm(seed=seed, view=self.SwarmParticle) if engine == "swarm" else None
+        self.particles = []
+        self.profiler  = Profiler(enabled=False)
+        self.attractor = self.Attractor(500, 250, radius=40, speed=1.0)
+        self.attractor.bounds = (150, 100, width-100, height-100)
+        self.zoom      = 1.25 # Canvas zoom (relative to attractor size).
+        self.frame     = 0
+        self.events    = [] # List of ("attract" | "repulse", Particle)-tuples.
+        self.rate      = 60 # Steps per second (the constants were tuned at 60 FPS).
+        self.limit     = 5  # Maximum steps per World.advance(), after that the simulation slows down.
+        self._time     = 0.0
+        self._previous = {} # Particle => (x, y) before the last step.
+        self._current  = {} # Particle => (x, y) after the last step, see World.interpolate().
+        self._zoom     = (self.zoom, None) # Zoom before the last step, after the last step.
+
+    def image(self, name):
+        return self.images[name] if self.images is not None else name
+
+    def particle(self, x, y, radius=6, speed=2.0, image=None, bounds=None, type=FEELIE):
+        """ Returns a new Particle (or SwarmParticle, with engine="swarm").
+        """
+        if self.swarm is None:
+            return self.Particle(x, y, radius=radius, speed=speed, image=image, bounds=bounds, type=type)
+        p = self.swarm.append(x, y, radius, speed, angle=random(360), bounds=bounds, image=image, type=type)
+        p.fading = type == FEELIE
+        return p
+
+    def remove(self, p):
+        """ Removes the given particle from the world.
+        """
+        self.particles.remove(p)
+        if self.swarm is not None:
+            self.swarm.remove(p)
+
+    def populate(self, n=40):
+        """ Adds n sleepie particles at random positions.
+        """
+        for i in range(n):
+            self.particles.append(
+                self.particle(x = random(self.width),
+                              y = random(self.height),
+                          image = self.image("flower1.png"),
+                         radius = 15 + random(20),
+                         bounds = (-65, -65, self.width+65, self.height+65),
+                           type = SLEEPIE))
+
+    def spawn(self):
+        """ Returns a new feelie particle that enters from the top left or top right.
+        """
+        name = choice(["flower%i.png" % i for i in range(2,6+1)], bias=0.25)
+        p = self.particle(x = choice((-30, self.width+30)),
+                          y = -30,
+                      image = self.image(name),
+                     radius = 15 + random(20),
+                     bounds = (-65, -65, self.width+65, self.height+65),
+                      speed = 3.5,
+                       type = FEELIE)
+        if name == "flower3.png":
+            p.radius = 20 + random(20)
+        if name == "flower4.png":
+            p.radius = 15 + random(10)
+        if name == "flower5.png":
+            p.radius = 15
+        if name == "flower6.png":
+            p.radius = 10 + random(5)
+        return p
+
+    def step(self, attract=False, spawn=False):
+        """ Advances the simulation by one frame.
+        """
+        with self.profiler("particles"):
+            self._step(attract, spawn)
+        with self.profiler("attractor"):
+            self.attractor.update(self.width/2, self.height/2, zoom=self.zoom)
+
+    def _step(self, attract=False, spawn=False):
+        # The particles in World.step(), before the attractor is updated.
+        a = self.attractor
+        self.frame += 1
+        self.events = []
+
+        # Zoom out as the attractor grows larger.
+        # Integrate the zoom scale to make the transition smoother.
+        d = (1.25 - len(a.particles) * 0.05)
+        if self.zoom > -0.15 and self.zoom > d:
+            self.zoom -= 0.0025
+        if self.zoom < +1.25 and self.zoom < d:
+            self.zoom += 0.0025
+
+        if self.swarm is not None:
+            self._update_swarm(attract, spawn)
+        for p in self.swarm is None and list(self.particles) or ():
+            d = distance(p.x, p.y, a.x, a.y)
+            p.update(zoom=self.zoom)
+            # When valence is low, unattached feelie particles fade away.
+            if spawn is False:
+                if p.parent is None and p.type == FEELIE:
+                    p.alpha -= 0.04
+                    p.alpha = max(p.alpha, 0)
+                    if p.alpha == 0:
+                        # Remove hidden feelies, so we have a chance to see new ones.
+                        self.particles.remove(p)
+            # Check if a particle falls within the attraction radius:
+            # If so, attract it when alpha is above average.
+            if attract is True:
+                if p.parent is None and p.frames >= 0 and p.alpha >= 0.25:
+                    if d < min(210, p.radius + a.radius * a.gravity):
+                        a.append(p)
+                        self.events.append(("attract", p))
+
+        # Repulse when alpha drops below average.
+        if attract is False:
+            if random() > 0.5:
+                if len(a.particles) > 0:
+                    self.events.append(("repulse", a.particles[0]))
+                    a.remove(a.particles[0])
+
+        # When valence is high, feelie particles appear.
+        if spawn is True:
+            if random() > 0.5:
+                if len(self.particles) < MAX_PARTICLES:
+                    self.particles.append(self.spawn())
+
+    def _update_swarm(self, attract=False, spawn=False):
+        # The loop in World.step() for all particles at once (engine="swarm").
+        s = self.swarm
+        a = self.attractor
+        n = s.n
+        d = s.distance(a.x, a.y)
+        s.update(zoom=self.zoom)
+        free = ~s.attached[:n]
+        # When valence is low, unattached feelie particles fade away.
+        if spawn is False:
+            m = free & s.fading[:n]
+            s.alpha[:n][m] = numpy.maximum(s.alpha[:n][m] - 0.04, 0)
+        # Particles within the attraction radius are attracted when alpha is above average.
+        # The radius grows with each particle attached, so check candidates one by one.
+        if attract is True:
+            m = free & (s.frames[:n] >= 0) & (s.alpha[:n] >= 0.25) & (d < 210)
+            for i in numpy.flatnonzero(m):
+                p = s[i]
+                if d[i] < min(210, p.radius + a.radius * a.gravity):
+                    a.append(p)
+                    self.events.append(("attract", p))
+        # Remove hidden feelies, so we have a chance to see new ones.
+        if spawn is False:
+            m = ~s.attached[:n] & s.fading[:n] & (s.alpha[:n] == 0)
+            for i in numpy.flatnonzero(m)[::-1]:
+                self.remove(s[i])
+
+    def advance(self, dt, attract=False, spawn=False):
+        """ Advances the simulation by dt seconds, in steps of 1/World.rate seconds.
+            Returns the fraction (0.0-1.0) of the next step that has passed, for World.interpolate().
+            World.events lists the events of all the steps taken.
+        """
+        self.restore()
+        self._time = min(self._time + dt, self.limit / float(self.rate))
+        events = []
+        while self._time >= 1.0 / self.rate:
+            self._time -= 1.0 / self.rate
+            self._previous = dict((p, (p.x, p.y)) for p in [self.attractor] + self.particles)
+            self._zoom = (self.zoom, None)
+            self.step(attract, spawn)
+            events.extend(self.events)
+        self.events = events
+        return self._time * self.rate
+
+    def interpolate(self, t=1.0):
+        """ Moves the particles (and the zoom) to a position between the previous step (t=0.0)
+            and the last step (t=1.0), for drawing.
+            The simulated positions are restored with World.restore() (or World.advance()).
+        """
+        self.restore()
+        for p in [self.attractor] + self.particles:
+            if p in self._previous:
+                x0, y0 = self._previous[p]
+                self._current[p] = (p.x, p.y)
+                p.x = x0 + (p.x - x0) * t
+                p.y = y0 + (p.y - y0) * t
+        z0 = self._zoom[0]
+        self._zoom = (z0, self.zoom)
+        self.zoom = z0 + (self.zoom - z0) * t
+
+    def restore(self):
+        """ Moves the particles back to their simulated position (see World.interpolate()).
+        """
+        for p, (x, y) in self._current.items():
+            p.x, p.y = x, y
+        if self._zoom[1] is not None:
+            self.zoom = self._zoom[1]
+        self._current = {}
+        self._zoom = (self._zoom[0], None)
+
+    def state(self):
+        """ Returns a list of (x, y, alpha, attached)-tuples for the attractor and each particle.
+        """
+        return [(p.x, p.y, p.alpha, p.parent is not None) for p in [self.attractor] + self.particles]
+
+    def checksum(self):
+        """ Returns an MD5 hash of World.state() (rounded to 6 decimals), see check.py.
+        """
+        return md5(repr([tuple(round(v, 6) for v in p) for p in self.state()])).hexdigest()
+
+######################################################################################################
+
+if __name__ == "__main__":
+
+    # Runs the simulation with alternating relaxation (attraction) and arousal (spawning),
+    # and prints the time per frame and a checksum of the final state:
+    # with the same seed (and the same Python and numpy), the checksum changes only if the physics change.
+    import sys
+    import time
+
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n      = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    r      = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    engine = sys.argv[4] if len(sys.argv) > 4 else "python"
+
+    w = World(seed=r, engine=engine)
+    w.populate(n)
+    t = time.time()
+    for i in range(frames):
+        w.step(attract=i // 300 % 2 == 1, spawn=i // 200 % 3 == 0)
+    t = time.time() - t
+    print "%s frames, %s particles: %.1f us/frame" % (frames, len(w.particles), t / frames * 1e6)
+    print "checksum: %s" % w.checksum()